@@ -0,0 +1,169 @@
+import numpy as np
+from scipy import ndimage
+from typing import Iterator, Tuple
+
+from results import Fold, FoldData
+
+class Augmenter():
+    def __init__(self, max_shift:float=1.0, max_rotation:float=8.0, max_scale:float=0.05,
+                elastic_alpha:float=0.0, elastic_sigma:float=4.0, noise_std:float=0.0):
+        """
+        Random variants of whole batches of images: shift, rotation and scale (one affine
+        transformation), elastic distortion and gaussian noise, all sampled in a single
+        map_coordinates call per batch. A transformation is disabled by setting its parameter to 0.
+
+        max_shift: maximum shift (pixels) in each direction
+        max_rotation: maximum rotation (degrees) in each direction
+        max_scale: the size changes at most max_scale (0.1 = +-10%)
+        elastic_alpha: intensity (pixels) of the elastic distortion (Simard et al., 2003)
+        elastic_sigma: smoothness (pixels) of the elastic distortion
+        noise_std: standard deviation of the gaussian noise (pixel values 0..255)
+        """
+        self.max_shift = max_shift
+        self.max_rotation = max_rotation
+        self.max_scale = max_scale
+        self.elastic_alpha = elastic_alpha
+        self.elastic_sigma = elastic_sigma
+        self.noise_std = noise_std
+
+    def coordinates(self, num_images:int, side:int, rng:np.random.Generator) -> np.ndarray:
+        """
+        Position (image, row, column) in the original batch of every pixel of the variants: (3, n, side, side)
+        """
+        center = (side - 1)/2
+        rows, columns = np.meshgrid(np.arange(side) - center, np.arange(side) - center, indexing='ij')
+        angle = np.deg2rad(rng.uniform(-self.max_rotation, self.max_rotation, num_images))[:, np.newaxis, np.newaxis]
+        scale = rng.uniform(1 - self.max_scale, 1 + self.max_scale, num_images)[:, np.newaxis, np.newaxis]
+        shift = rng.uniform(-self.max_shift, self.max_shift, (2, num_images))[:, :, np.newaxis, np.newaxis]
+
+        # inverse transformation: from the variant pixel to the original one
+        source_rows = center + (rows*np.cos(angle) + columns*np.sin(angle))/scale - shift[0]
+        source_columns = center + (columns*np.cos(angle) - rows*np.sin(angle))/scale - shift[1]
+
+        if self.elastic_alpha > 0:
+            # random displacement fields smoothed with a gaussian, one per image
+            displacement = rng.uniform(-1, 1, (2, num_images, side, side))
+            displacement = ndimage.gaussian_filter(displacement, sigma=(0, 0, self.elastic_sigma, self.elastic_sigma))
+            # normalized so elastic_alpha is the largest displacement of each image
+            maximum = np.abs(displacement).max(axis=(0, 2, 3), keepdims=True)
+            displacement *= self.elastic_alpha/np.where(maximum > 0, maximum, 1)
+            source_rows = source_rows + displacement[0]
+            source_columns = source_columns + displacement[1]
+
+        images = np.broadcast_to(np.arange(num_images, dtype=np.float64)[:, np.newaxis, np.newaxis], source_rows.shape)
+        return np.stack((images, source_rows, source_columns))
+
+    def __call__(self, x:np.ndarray, rng:np.random.Generator) -> np.ndarray:
+        """
+        One variant of each row of x (n x pixels, square uint8 images, 0..255 or 0/1)
+        """
+        x = np.asarray(x)
+        num_images = len(x)
+        side = int(round(np.sqrt(x.shape[1])))
+        if side*side != x.shape[1]:
+            raise ValueError(f"{x.shape[1]} features are not a square image")
+        if num_images == 0:
+            return x.copy()
+        binary = x.max() <= 1
+
+        images = x.reshape(num_images, side, side).astype(np.float32)
+        values = ndimage.map_coordinates(images, self.coordinates(num_images, side, rng), order=1, cval=0.0)
+        if self.noise_std > 0:
+            values += rng.normal(0, self.noise_std*(1/255 if binary else 1), values.shape).astype(np.float32)
+
+        if binary:
+            # keep the 0/1 format of the create_binary_base files
+            return (values > 0.5).astype(x.dtype).reshape(num_images, -1)
+        return np.clip(np.rint(values), 0, 255).astype(np.uint8).reshape(num_images, -1)
+
+def fold_seed(fold:Fold, seed:int=1) -> np.ndarray:
+    """
+    Seed of the augmentation of a fold: the same fold (data and rows) always gets the same variants
+    """
+    fingerprint = fold.fingerprint()
+    return np.array([seed] + [int(fingerprint[i:i+8], 16) for i in range(0, len(fingerprint), 8)], dtype=np.uint64)
+
+class AugmentedFold():
+    def __init__(self, fold:Fold, augmenter:Augmenter, num_copies:int=1, keep_original:bool=True,
+                seed:int=1, chunk_size:int=1024):
+        """
+        Fold whose practice rows are read chunk by chunk together with num_copies random variants of
+        each chunk, created when the chunk is read (nothing is stored). The rows to predict are not
+        changed. It is used as a streaming.StreamingFold (e.g. by StreamingMachineLearning.eval_fold);
+        the other methods, GoalOptimization and Experiment use to_fold.
+
+        keep_original: the practice chunks also include the original rows
+        seed: with the fold fingerprint, it defines the variants, every pass over the chunks gets the same ones
+        """
+        self.fold = fold
+        self.augmenter = augmenter
+        self.num_copies = num_copies
+        self.keep_original = keep_original
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self._fold_seed = None
+
+    def __len__(self):
+        # number of practice rows, with the variants
+        return len(self.fold.practice_indices)*(self.num_copies + int(self.keep_original))
+
+    def _rng(self, num_chunk:int, num_copy:int) -> np.random.Generator:
+        # each (chunk, copy) has its own generator, so chunks can be read in any order
+        if self._fold_seed is None:
+            self._fold_seed = fold_seed(self.fold, self.seed)
+        return np.random.default_rng(np.concatenate((self._fold_seed, np.array([num_chunk, num_copy], dtype=np.uint64))))
+
+    def practice_chunks(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        data = self.fold.data
+        indices = self.fold.practice_indices
+        for num_chunk, ini in enumerate(range(0, len(indices), self.chunk_size)):
+            rows = indices[ini:ini+self.chunk_size]
+            x, y = data.x[rows], data.y[rows]
+            if self.keep_original:
+                yield x, y
+            for num_copy in range(self.num_copies):
+                yield self.augmenter(x, self._rng(num_chunk, num_copy)), y
+
+    def predict_chunks(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        # the rows to predict stay clean
+        data = self.fold.data
+        indices = self.fold.predict_indices
+        for ini in range(0, len(indices), self.chunk_size):
+            rows = indices[ini:ini+self.chunk_size]
+            yield data.x[rows], data.y[rows]
+
+    def to_fold(self) -> Fold:
+        """
+        Fold (for ScikitLearnMachineLearning, KerasMachineLearning, GoalOptimization or Experiment) with the same
+        variants as practice_chunks. They are stored after the rows of the data, so the data is copied and grows by
+        num_copies x practice rows. Each validation fold of the original fold gets the variants of its own practice
+        rows only (never the ones of the rows it predicts); the rows to predict are not changed.
+        """
+        data = self.fold.data
+        practice_indices = np.asarray(self.fold.practice_indices)
+        num_practice = len(practice_indices)
+        x_variants = np.empty((self.num_copies, num_practice, data.x.shape[1]), dtype=data.x.dtype)
+        for num_chunk, ini in enumerate(range(0, num_practice, self.chunk_size)):
+            x = data.x[practice_indices[ini:ini+self.chunk_size]]
+            for num_copy in range(self.num_copies):
+                x_variants[num_copy, ini:ini+len(x)] = self.augmenter(x, self._rng(num_chunk, num_copy))
+
+        augmented_data = FoldData(np.concatenate((data.x, x_variants.reshape(-1, data.x.shape[1]))),
+                                np.concatenate((data.y, np.tile(data.y[practice_indices], self.num_copies))),
+                                data.columns, data.col_category,
+                                # a variant has the label of its original row
+                                np.concatenate((data.index, np.tile(data.index[practice_indices], self.num_copies))),
+                                data.category_position)
+        # position of each practice row in practice_indices (its variants are at len(data) + copy*num_practice + position)
+        positions = np.full(len(data), -1, dtype=np.int64)
+        positions[practice_indices] = np.arange(num_practice)
+
+        def with_variants(rows:np.ndarray) -> np.ndarray:
+            rows = np.asarray(rows)
+            variants = len(data) + (np.arange(self.num_copies)[:, np.newaxis]*num_practice + positions[rows][np.newaxis, :]).ravel()
+            return np.concatenate((rows, variants)) if self.keep_original else variants
+
+        validation_splits = [(with_variants(fold_validation.practice_indices), fold_validation.predict_indices)
+                                for fold_validation in self.fold.arr_folds_validation]
+        return Fold.from_indices(augmented_data, with_variants(practice_indices), self.fold.predict_indices,
+                                validation_splits=validation_splits)
@@ -0,0 +1,338 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from typing import Callable, Dict, List
+
+COL_CATEGORY = 'y_class'
+
+def synthetic_mnist(num_rows:int, num_features:int=784, seed:int=1):
+    """
+    MNIST-shaped DataFrame: uint8 pixels (mostly zeros, as the digits) and a y_class column 0..9.
+    784 features are named as the 28x28 files, 400 as the cropped 20x20 ones.
+    """
+    import pandas as pd
+    side = int(round(np.sqrt(num_features)))
+    first = 1 if num_features == 784 else 5
+    columns = [f"pixel_{row}_{column}" for row in range(first, first+side) for column in range(first, first+side)][:num_features]
+
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(0, 10, num_rows)
+    pixels = rng.integers(0, 256, (num_rows, num_features), dtype=np.uint8)
+    # each class lights a different band of pixels, so models have something to learn
+    ink = rng.random((num_rows, num_features)) < 0.1
+    band = (np.arange(num_features)[np.newaxis, :]*10//num_features) == labels[:, np.newaxis]
+    pixels[~(ink | (band & (rng.random((num_rows, num_features)) < 0.5)))] = 0
+
+    df_data = pd.DataFrame(pixels, columns=columns)
+    df_data[COL_CATEGORY] = labels
+    return df_data
+
+def _write_csv(df_data, directory:str) -> str:
+    file_name = os.path.join(directory, 'input.csv')
+    df_data.to_csv(file_name, index=False)
+    return file_name
+
+# Each benchmark receives the synthetic data and a temporary directory.
+# It returns a function (the timed part) that returns the number of rows processed.
+
+def bench_generate_k_folds(df_data, directory:str, options) -> Callable[[], int]:
+    from results import Fold
+    def run():
+        arr_folds = Fold.generate_k_folds(df_data, 10, COL_CATEGORY, num_folds_validation=3, num_threshold_validation=1)
+        for fold in arr_folds:
+            fold.x_practice, fold.x_to_predict
+        return len(df_data)
+    return run
+
+def bench_result_metrics(df_data, directory:str, options) -> Callable[[], int]:
+    from results import Result
+    y = df_data[COL_CATEGORY].to_numpy()
+    predict_y = np.where(np.random.default_rng(2).random(len(y)) < 0.8, y, (y+1) % 10)
+    def run():
+        result = Result(y, predict_y)
+        result.macro_f1, result.accuracy, result.precision, result.recall, result.confusion_matrix
+        return len(y)
+    return run
+
+def bench_information_gain(df_data, directory:str, options) -> Callable[[], int]:
+    from information_gain import information_gain_matrix
+    def run():
+        information_gain_matrix(df_data, COL_CATEGORY)
+        return len(df_data)
+    return run
+
+def bench_create_selected_base(df_data, directory:str, options) -> Callable[[], int]:
+    # the work_methods generators themselves, so the wiring of their stages is measured too
+    from work_methods import create_filter_array, create_selected_base
+    input_file_name = _write_csv(df_data, directory)
+    # the 20x20 crop for 784 features, one of every two otherwise
+    num_features = df_data.shape[1]-1
+    if num_features == 784:
+        filtr_array = create_filter_array(28, 4, 4, 24, 24)
+    else:
+        filtr_array = [1, 0]*(num_features//2)+[1]*(num_features % 2)+[2]
+    def run():
+        create_selected_base(input_file_name, os.path.join(directory, 'output.csv'), filtr_array)
+        return len(df_data)
+    return run
+
+def bench_create_binary_base(df_data, directory:str, options) -> Callable[[], int]:
+    from work_methods import create_binary_base
+    input_file_name = _write_csv(df_data, directory)
+    def run():
+        create_binary_base(input_file_name, os.path.join(directory, 'output.csv'))
+        return len(df_data)
+    return run
+
+def bench_experiment(df_data, directory:str, options) -> Callable[[], int]:
+    import optuna
+    from results import Fold
+    from evaluation import Experiment, GoalOptimizationDecisionTree
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    arr_folds = Fold.generate_k_folds(df_data, 3, COL_CATEGORY, num_folds_validation=2, num_threshold_validation=1)
+    def run():
+        experiment = Experiment(arr_folds, None, GoalOptimizationDecisionTree, num_trials=options.num_trials,
+                                sampler=optuna.samplers.TPESampler(seed=1, n_startup_trials=10))
+        experiment.calculate_results()
+        return len(df_data)
+    return run
+
+def _bench_predict(method, df_data) -> Callable[[], int]:
+    # fit on half of the rows (not timed), the timed part predicts the other half
+    from results import Fold
+    half = len(df_data)//2
+    fold = Fold(df_data.iloc[:half], df_data.iloc[half:], COL_CATEGORY)
+    method.eval_fold(fold)
+    x_to_predict = fold.x_to_predict.astype(np.uint8)
+    def run():
+        method.predict(x_to_predict)
+        return len(x_to_predict)
+    return run
+
+def bench_predict_decision_tree(df_data, directory:str, options) -> Callable[[], int]:
+    from sklearn.tree import DecisionTreeClassifier
+    from method import ScikitLearnMachineLearning
+    return _bench_predict(ScikitLearnMachineLearning(DecisionTreeClassifier(random_state=2)), df_data)
+
+def bench_predict_random_forest(df_data, directory:str, options) -> Callable[[], int]:
+    from sklearn.ensemble import RandomForestClassifier
+    from method import ScikitLearnMachineLearning
+    return _bench_predict(ScikitLearnMachineLearning(RandomForestClassifier(n_estimators=100, random_state=2)), df_data)
+
+def bench_predict_cnn(df_data, directory:str, options) -> Callable[[], int]:
+    from keras_method import KerasMachineLearning
+    return _bench_predict(KerasMachineLearning('cnn_basica', epochs=1), df_data)
+
+def bench_predict_cnn_int8(df_data, directory:str, options) -> Callable[[], int]:
+    from keras_method import KerasMachineLearning
+    return _bench_predict(KerasMachineLearning('cnn_basica', epochs=1, quantize=True), df_data)
+
+BENCHMARKS:Dict[str, Callable] = {
+    'generate_k_folds': bench_generate_k_folds,
+    'result_metrics': bench_result_metrics,
+    'information_gain': bench_information_gain,
+    'create_selected_base': bench_create_selected_base,
+    'create_binary_base': bench_create_binary_base,
+    'experiment': bench_experiment,
+    'predict_decision_tree': bench_predict_decision_tree,
+    'predict_random_forest': bench_predict_random_forest,
+    'predict_cnn': bench_predict_cnn,
+    'predict_cnn_int8': bench_predict_cnn_int8,
+}
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak/(1024*1024) if sys.platform == 'darwin' else peak/1024
+
+def _run_benchmark(name:str, num_rows:int, num_features:int, options, queue) -> None:
+    # runs in its own process, so the peak RSS belongs to this benchmark only
+    import warnings
+    warnings.filterwarnings('ignore')
+    try:
+        df_data = synthetic_mnist(num_rows, num_features)
+        with tempfile.TemporaryDirectory() as directory:
+            run = BENCHMARKS[name](df_data, directory, options)
+            arr_times = []
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                num_processed = run()
+                arr_times.append(time.perf_counter() - start)
+    except Exception as error:
+        # the parent reports the failed benchmark instead of waiting for a result
+        queue.put({'error': f"{type(error).__name__}: {error}"})
+        return
+    wall_time = min(arr_times)
+    queue.put({'wall_time_s': wall_time, 'peak_rss_mb': _peak_rss_mb(),
+                'throughput_rows_per_s': num_processed/wall_time if wall_time > 0 else float('inf')})
+
+def _wait_result(process, queue, timeout:float=None) -> dict:
+    """
+    Result put on queue by _run_benchmark, or an error record when the process dies
+    without one (e.g. killed when out of memory) or takes longer than timeout seconds
+    """
+    deadline = time.perf_counter() + timeout if timeout is not None else None
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except queue_module.Empty:
+            pass
+        if process.exitcode is not None:
+            try:
+                # the result may still be in the pipe when the process has just finished
+                return queue.get(timeout=1.0)
+            except queue_module.Empty:
+                return {'error': f"process exited with code {process.exitcode} without a result"}
+        if deadline is not None and time.perf_counter() > deadline:
+            process.terminate()
+            return {'error': f"timeout after {timeout}s"}
+
+def run_benchmarks(names:List[str], sizes:List[int], features:List[int], options) -> dict:
+    """
+    Failed benchmarks get an 'error' record instead of their measurements
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        for num_rows in sizes:
+            for num_features in features:
+                key = f"{name}[rows={num_rows},features={num_features}]"
+                queue = context.Queue()
+                process = context.Process(target=_run_benchmark, args=(name, num_rows, num_features, options, queue))
+                process.start()
+                results[key] = _wait_result(process, queue, getattr(options, 'timeout', None))
+                process.join()
+                if 'error' in results[key]:
+                    print(f"{key}: FAILED {results[key]['error']}", flush=True)
+                else:
+                    print(f"{key}: {results[key]['wall_time_s']:.4f}s, {results[key]['peak_rss_mb']:.1f}MB, "
+                            f"{results[key]['throughput_rows_per_s']:.0f} rows/s", flush=True)
+
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                    'platform': platform.platform(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+# maximum (start-up wall time in seconds, peak RSS in MB) of each cli subcommand before it reads any data,
+# checked by tests/test_cli.py: cron conversion and scoring jobs must start well under a second.
+# run-experiment needs sklearn and optuna (about 2s and 170MB), its target only guards against regressions.
+IMPORT_TARGET = (1.0, 100)
+IMPORT_TARGETS:Dict[str, tuple] = {
+    'convert': IMPORT_TARGET,
+    'select-features': IMPORT_TARGET,
+    'info-gain': IMPORT_TARGET,
+    'run-experiment': (3.0, 220),
+    'report': IMPORT_TARGET,
+    'recognize': IMPORT_TARGET,
+}
+
+_IMPORT_CODE = """
+import importlib, json, resource, sys
+import cli
+for module in cli.COMMAND_MODULES[sys.argv[1]]:
+    importlib.import_module(module)
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    # ru_maxrss survives exec (it would be the peak of a large parent, e.g. pytest), VmHWM does not
+    with open('/proc/self/status') as file:
+        peak = next(int(line.split()[1]) for line in file if line.startswith('VmHWM:'))
+except (OSError, StopIteration):
+    pass
+print(json.dumps({'peak_rss_kb': peak}))
+"""
+
+def check_imports(commands:List[str], repeat:int) -> dict:
+    """
+    Start-up time (a new interpreter importing cli and the modules of the subcommand) and peak RSS
+    """
+    results = {}
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for command in commands:
+        arr_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', _IMPORT_CODE, command], cwd=directory,
+                                    capture_output=True, text=True, check=True).stdout
+            arr_times.append(time.perf_counter() - start)
+        peak = json.loads(output.splitlines()[-1])['peak_rss_kb']
+        key = f"import[{command}]"
+        results[key] = {'wall_time_s': min(arr_times),
+                        'peak_rss_mb': peak/(1024*1024) if sys.platform == 'darwin' else peak/1024}
+        print(f"{key}: {results[key]['wall_time_s']:.3f}s, {results[key]['peak_rss_mb']:.1f}MB", flush=True)
+    return results
+
+def exceeded_import_targets(results:dict) -> List[str]:
+    arr_exceeded = []
+    for command, (max_time, max_rss) in IMPORT_TARGETS.items():
+        values = results.get(f"import[{command}]")
+        if values is not None and (values['wall_time_s'] > max_time or values['peak_rss_mb'] > max_rss):
+            arr_exceeded.append(f"import[{command}]: {values['wall_time_s']:.3f}s (max {max_time}s), "
+                                f"{values['peak_rss_mb']:.1f}MB (max {max_rss}MB)")
+    return arr_exceeded
+
+def compare(current:dict, baseline:dict, threshold:float) -> List[str]:
+    """
+    Benchmarks whose wall time or peak RSS grew more than threshold (e.g. 0.1 = 10%) over the baseline
+    """
+    regressions = []
+    for key, values in current['results'].items():
+        if key not in baseline['results'] or 'error' in values or 'error' in baseline['results'][key]:
+            continue
+        for metric in ('wall_time_s', 'peak_rss_mb'):
+            reference = baseline['results'][key][metric]
+            if reference > 0 and values[metric] > reference*(1+threshold):
+                regressions.append(f"{key} {metric}: {reference:.4f} -> {values[metric]:.4f} (+{(values[metric]/reference-1)*100:.1f}%)")
+    return regressions
+
+def main(args:List[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation pipeline on synthetic MNIST-shaped data")
+    parser.add_argument('--benchmarks', nargs='+', default=[name for name in BENCHMARKS if not name.startswith('predict_cnn')],
+                        choices=list(BENCHMARKS), help="predict_cnn* (tensorflow) only run when selected")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[2000, 20000, 70000])
+    parser.add_argument('--features', nargs='+', type=int, default=[784, 400])
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each benchmark, the fastest is kept")
+    parser.add_argument('--num-trials', type=int, default=5, help="optuna trials per fold of the experiment benchmark")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="json written by a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative growth reported as regression")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds after which a benchmark is stopped and reported as failed")
+    parser.add_argument('--imports', action='store_true',
+                        help="only check the start-up time and RSS of the cli subcommands against IMPORT_TARGETS")
+    options = parser.parse_args(args)
+
+    if options.imports:
+        import cli
+        current = {'results': check_imports(list(cli.COMMAND_MODULES), options.repeat)}
+        for exceeded in exceeded_import_targets(current['results']):
+            print(f"TARGET EXCEEDED {exceeded}")
+    else:
+        current = run_benchmarks(options.benchmarks, options.sizes, options.features, options)
+    with open(options.output, 'w') as file:
+        json.dump(current, file, indent=2)
+
+    if options.imports and exceeded_import_targets(current['results']):
+        return 1
+    failed = [key for key, values in current['results'].items() if 'error' in values]
+    if failed:
+        print(f"FAILED {', '.join(failed)}")
+        return 1
+
+    if options.baseline is not None:
+        with open(options.baseline, 'r') as file:
+            regressions = compare(current, json.load(file), options.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
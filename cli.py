@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+# Each subcommand imports only what it uses, so a conversion job does not load
+# sklearn, optuna or the plotting libraries (checked by tests/test_cli.py).
+COMMAND_MODULES = {
+    'convert': ('file_pipeline', 'dataset_store'),
+    'select-features': ('feature_selection', 'file_pipeline'),
+    'info-gain': ('feature_selection',),
+    'run-experiment': ('evaluation', 'split_plan'),
+    'report': (),
+    'recognize': ('segmentation', 'method'),
+}
+
+METHODS = ('decision_tree', 'random_forest', 'hamming_knn')
+
+def _load_fold_data(input_name:str, col_category:str):
+    """
+    FoldData of a csv or of a store directory (convert --store)
+    """
+    if os.path.isdir(input_name):
+        from dataset_store import load_store
+        return load_store(input_name).fold_data()
+    import pandas as pd
+    from results import FoldData
+    return FoldData.from_dataframe(pd.read_csv(input_name), col_category)
+
+def convert(options) -> int:
+    if options.store:
+        from dataset_store import convert_csv_to_store
+        store = convert_csv_to_store(options.input, options.output, chunk_size=options.chunk_size)
+        print(f"{options.output}: {len(store)} rows, {store.num_features} features, packed={store.packed}")
+        return 0
+
+    from file_pipeline import run_pipeline, CropStage, BinarizeStage, DropMissingStage
+    stages = []
+    if options.crop is not None:
+        from work_methods import create_filter_array
+        stages.append(CropStage(create_filter_array(options.square_reference, *options.crop)))
+    # same order as create_selected_base and create_binary_base
+    stages.append(DropMissingStage())
+    if options.binary:
+        stages.append(BinarizeStage(options.threshold))
+    run_pipeline(options.input, options.output, stages, options.chunk_size)
+    return 0
+
+def select_features(options) -> int:
+    import numpy as np
+    from feature_selection import select_features as select, filter_array_from_indices
+    if options.csv_output is not None and os.path.isdir(options.input):
+        print("--csv-output needs a csv input", file=sys.stderr)
+        return 2
+    data = _load_fold_data(options.input, options.col_category)
+    indices = select(data, data.col_category, options.top_k, options.threshold, options.num_bins)
+    np.save(options.output, indices)
+    print(f"{options.output}: {len(indices)} of {len(data.columns)} features")
+
+    if options.csv_output is not None:
+        from file_pipeline import run_pipeline, CropStage, DropMissingStage
+        run_pipeline(options.input, options.csv_output,
+                    [CropStage(filter_array_from_indices(indices, len(data.columns))), DropMissingStage()], options.chunk_size)
+    return 0
+
+def info_gain(options) -> int:
+    from feature_selection import rank_features
+    data = _load_fold_data(options.input, options.col_category)
+    info_gain = rank_features(data, data.col_category, options.num_bins)
+    if options.output is not None:
+        info_gain.to_csv(options.output, header=True)
+    for feature, value in info_gain.iloc[:options.top].items():
+        print(f"{feature}\t{value:.6f}")
+    return 0
+
+def run_experiment(options) -> int:
+    import optuna
+    from results import Fold
+    from evaluation import (Experiment, GoalOptimizationDecisionTree, GoalOptimizationRandomForest,
+                            GoalOptimizationHammingKNN)
+    goals = {'decision_tree': GoalOptimizationDecisionTree, 'random_forest': GoalOptimizationRandomForest,
+            'hamming_knn': GoalOptimizationHammingKNN}
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+    data = _load_fold_data(options.input, options.col_category)
+    if options.split_plan is not None:
+        from split_plan import SplitPlan
+        if os.path.exists(options.split_plan):
+            plan = SplitPlan.load(options.split_plan)
+        else:
+            plan = SplitPlan.stratified(data.y, options.folds, seed=options.seed, num_folds_validation=options.validation_folds)
+            plan.save(options.split_plan)
+        arr_folds = plan.folds(data, data.col_category)
+    else:
+        arr_folds = Fold.generate_k_folds(data, options.folds, data.col_category, seed=options.seed,
+                                        num_folds_validation=options.validation_folds)
+
+    cache = None
+    if options.cache_dir is not None:
+        from model_cache import ModelCache
+        cache = ModelCache(options.cache_dir)
+
+    experiment = Experiment(arr_folds, None, goals[options.method], num_trials=options.num_trials,
+                            sampler=optuna.samplers.TPESampler(seed=options.seed, n_startup_trials=10),
+                            n_jobs=options.n_jobs, n_jobs_validation=options.n_jobs_validation, cache=cache,
+                            storage=options.storage, study_name=options.study_name)
+    experiment.calculate_results()
+
+    output = {'input': options.input, 'method': options.method, 'macro_f1_avg': float(experiment.macro_f1_avg), 'folds': []}
+    for num_fold, (result, study) in enumerate(zip(experiment.results, experiment.studies_per_fold)):
+        output['folds'].append({'fold': num_fold, 'macro_f1': result.macro_f1, 'accuracy': float(result.accuracy),
+                                'best_params': study.best_trial.params, 'labels': result.labels.tolist(),
+                                'confusion_matrix': result.confusion_matrix_array.tolist()})
+    with open(options.output, 'w') as file:
+        json.dump(output, file, indent=2)
+
+    if options.save_models is not None:
+        os.makedirs(options.save_models, exist_ok=True)
+        for num_fold, best_method in enumerate(experiment.best_methods_per_fold):
+            best_method.save(os.path.join(options.save_models, f"fold_{num_fold}.joblib"))
+
+    print(f"{options.output}: macro f1 {output['macro_f1_avg']:.4f} over {len(arr_folds)} folds")
+    return 0
+
+def report(options) -> int:
+    with open(options.results, 'r') as file:
+        output = json.load(file)
+    print(f"{output['input']} - {output['method']}")
+    for fold in output['folds']:
+        print(f"fold {fold['fold']}: macro f1 {fold['macro_f1']:.4f}, accuracy {fold['accuracy']:.4f}, {fold['best_params']}")
+    print(f"average macro f1: {output['macro_f1_avg']:.4f}")
+
+    if options.output_dir is not None:
+        from results import Result
+        from report import generate_report
+        results = [Result.from_confusion_matrix(fold['labels'], fold['confusion_matrix']) for fold in output['folds']]
+        file_name = generate_report(results, options.output_dir, f"{output['input']} - {output['method']}",
+                                    [{'best_params': fold['best_params']} for fold in output['folds']], options.n_jobs)
+        print(file_name)
+    return 0
+
+def recognize(options) -> int:
+    from method import MachineLearningMethod
+    from segmentation import PageRecognizer, pages_per_second
+    filtr_array = None
+    if options.crop is not None:
+        from work_methods import create_filter_array
+        filtr_array = create_filter_array(options.square_reference, *options.crop)
+    recognizer = PageRecognizer(MachineLearningMethod.load(options.model), filtr_array, options.binary,
+                                options.batch_size, min_area=options.min_area, max_area=options.max_area)
+
+    page_results = []
+    output = {'pages': []}
+    for file_name, page_result in zip(options.pages, recognizer.recognize_pages(options.pages)):
+        page_results.append(page_result)
+        print(f"{file_name}: {''.join(str(prediction) for prediction in page_result.predictions)}")
+        output['pages'].append({'file': file_name, 'boxes': page_result.boxes.tolist(),
+                                'predictions': page_result.predictions.tolist(), 'timings': page_result.timings})
+    output['summary'] = pages_per_second(page_results)
+    print(f"{output['summary']['pages_per_second']:.2f} pages/s, {output['summary']['characters_per_second']:.0f} characters/s")
+
+    if options.output is not None:
+        with open(options.output, 'w') as file:
+            json.dump(output, file, indent=2)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Optical character recognition: data preparation and experiments")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_convert = subparsers.add_parser('convert', help="crop and/or binarize a pixel csv, or convert it to a store")
+    parser_convert.add_argument('input')
+    parser_convert.add_argument('output', help="csv, or a directory with --store")
+    parser_convert.add_argument('--store', action='store_true', help="write a memory-mappable store (dataset_store)")
+    parser_convert.add_argument('--crop', type=int, nargs=4, metavar=('START_ROW', 'START_COLUMN', 'LAST_ROW', 'LAST_COLUMN'))
+    parser_convert.add_argument('--square-reference', type=int, default=28)
+    parser_convert.add_argument('--binary', action='store_true', help="pixels above --threshold become 1, the others 0")
+    parser_convert.add_argument('--threshold', type=int, default=0)
+    parser_convert.add_argument('--chunk-size', type=int, default=4096)
+    parser_convert.set_defaults(function=convert)
+
+    parser_select = subparsers.add_parser('select-features', help="pixels with the highest information gain")
+    parser_select.add_argument('input', help="csv or store directory")
+    parser_select.add_argument('output', help=".npy with the positions of the selected features")
+    parser_select.add_argument('--top-k', type=int)
+    parser_select.add_argument('--threshold', type=float)
+    parser_select.add_argument('--num-bins', type=int)
+    parser_select.add_argument('--csv-output', help="also write the csv input with only the selected features")
+    parser_select.add_argument('--col-category', default='y_class')
+    parser_select.add_argument('--chunk-size', type=int, default=4096)
+    parser_select.set_defaults(function=select_features)
+
+    parser_info_gain = subparsers.add_parser('info-gain', help="information gain of every feature")
+    parser_info_gain.add_argument('input', help="csv or store directory")
+    parser_info_gain.add_argument('--output', help="csv with the information gain of every feature")
+    parser_info_gain.add_argument('--top', type=int, default=20, help="features printed")
+    parser_info_gain.add_argument('--num-bins', type=int)
+    parser_info_gain.add_argument('--col-category', default='y_class')
+    parser_info_gain.set_defaults(function=info_gain)
+
+    parser_experiment = subparsers.add_parser('run-experiment', help="cross validation with hyperparameter search")
+    parser_experiment.add_argument('input', help="csv or store directory")
+    parser_experiment.add_argument('--method', choices=METHODS, default='decision_tree')
+    parser_experiment.add_argument('--output', default='results.json')
+    parser_experiment.add_argument('--folds', type=int, default=5)
+    parser_experiment.add_argument('--validation-folds', type=int, default=3)
+    parser_experiment.add_argument('--num-trials', type=int, default=100)
+    parser_experiment.add_argument('--seed', type=int, default=1)
+    parser_experiment.add_argument('--split-plan', help="stratified split plan (.npz), created if it does not exist")
+    parser_experiment.add_argument('--n-jobs', type=int, default=1)
+    parser_experiment.add_argument('--n-jobs-validation', type=int, default=1)
+    parser_experiment.add_argument('--cache-dir', help="reuse fitted models (model_cache)")
+    parser_experiment.add_argument('--storage', help="database URL (sqlite:///search.db) or journal file to resume or share the search")
+    parser_experiment.add_argument('--study-name', default='experiment')
+    parser_experiment.add_argument('--save-models', help="directory to save the best method of each fold")
+    parser_experiment.add_argument('--col-category', default='y_class')
+    parser_experiment.set_defaults(function=run_experiment)
+
+    parser_report = subparsers.add_parser('report', help="summary of a run-experiment output")
+    parser_report.add_argument('results', help="json written by run-experiment")
+    parser_report.add_argument('--output-dir', help="also write the html/png report (report.generate_report) in this directory")
+    parser_report.add_argument('--n-jobs', type=int, help="processes rendering the figures")
+    parser_report.set_defaults(function=report)
+
+    parser_recognize = subparsers.add_parser('recognize', help="segment scanned pages and classify their characters")
+    parser_recognize.add_argument('model', help="file written by MachineLearningMethod.save")
+    parser_recognize.add_argument('pages', nargs='+', help="page images (png, jpg...)")
+    parser_recognize.add_argument('--crop', type=int, nargs=4, metavar=('START_ROW', 'START_COLUMN', 'LAST_ROW', 'LAST_COLUMN'),
+                                help="pixels used by the model (as create_filter_array)")
+    parser_recognize.add_argument('--square-reference', type=int, default=28)
+    parser_recognize.add_argument('--binary', action='store_true', help="the model was trained with 0/1 pixels")
+    parser_recognize.add_argument('--batch-size', type=int, default=256)
+    parser_recognize.add_argument('--min-area', type=int, default=10, help="smaller components are noise")
+    parser_recognize.add_argument('--max-area', type=int, help="larger components (form lines) are ignored")
+    parser_recognize.add_argument('--output', help="json with the boxes, predictions and timings of every page")
+    parser_recognize.set_defaults(function=recognize)
+
+    return parser
+
+def main(args:List[str]=None) -> int:
+    options = build_parser().parse_args(args)
+    return options.function(options)
+
+if __name__ == '__main__':
+    sys.exit(main())
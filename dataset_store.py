@@ -0,0 +1,133 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import List
+
+from file_pipeline import read_chunks, DropMissingStage
+from results import FoldData
+
+PIXELS_FILE_NAME = 'pixels.u8'
+LABELS_FILE_NAME = 'labels.npy'
+META_FILE_NAME = 'meta.json'
+
+def pack_binary_images(pixels:np.ndarray) -> np.ndarray:
+    """
+    Pack 0/1 images (rows x pixels) into bits, 8 pixels per byte (784 pixels -> 98 bytes)
+    """
+    return np.packbits(pixels != 0, axis=1)
+
+def unpack_binary_images(packed:np.ndarray, num_features:int) -> np.ndarray:
+    return np.unpackbits(packed, axis=1, count=num_features)
+
+def convert_csv_to_store(input_file_name:str, store_dir:str, packed:bool=None, chunk_size:int=4096) -> "DatasetStore":
+    """
+    Convert a pixel csv (pixel columns followed by the category column) to a store directory with
+    the pixels as a raw uint8 blob, the categories as labels.npy and the column names in meta.json.
+    Rows with missing values are dropped.
+
+    input_file_name: csv to be converted
+    store_dir: output directory
+    packed: store 8 pixels per byte, only for 0/1 images (default: True for the _binary files)
+    chunk_size: rows converted at a time
+    """
+    if packed is None:
+        packed = os.path.splitext(os.path.basename(input_file_name))[0].endswith('_binary')
+    os.makedirs(store_dir, exist_ok=True)
+
+    drop_missing = DropMissingStage()
+    arr_labels = []
+    num_rows = 0
+    with open(input_file_name, 'r') as file, open(os.path.join(store_dir, PIXELS_FILE_NAME), 'wb') as pixels_file:
+        header = file.readline().rstrip('\r\n').split(',')
+        for chunk in read_chunks(file, len(header), chunk_size):
+            chunk = drop_missing(chunk)
+            if packed:
+                if (chunk.pixels > 1).any():
+                    raise ValueError(f"{input_file_name} has values other than 0 and 1, it can not be packed")
+                pixels_file.write(pack_binary_images(chunk.pixels).tobytes())
+            else:
+                pixels_file.write(chunk.pixels.tobytes())
+            arr_labels.append(chunk.labels)
+            num_rows += len(chunk)
+
+    labels = np.concatenate(arr_labels) if arr_labels else np.zeros(0, dtype=np.int64)
+    np.save(os.path.join(store_dir, LABELS_FILE_NAME), labels.astype(np.min_scalar_type(labels.max() if len(labels) else 0)))
+
+    meta = {'columns': header[:-1], 'col_category': header[-1], 'num_rows': num_rows, 'packed': packed}
+    with open(os.path.join(store_dir, META_FILE_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    return DatasetStore(store_dir)
+
+class DatasetStore():
+    def __init__(self, store_dir:str):
+        """
+        Read-only access to a store created by convert_csv_to_store.
+        The pixels are memory mapped, so opening is instantaneous and processes reading the
+        same store share its pages.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE_NAME), 'r') as meta_file:
+            meta = json.load(meta_file)
+        self.columns:List[str] = meta['columns']
+        self.col_category:str = meta['col_category']
+        self.num_rows:int = meta['num_rows']
+        self.packed:bool = meta['packed']
+        self._pixels = None
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def num_features(self) -> int:
+        return len(self.columns)
+
+    @property
+    def raw_pixels(self) -> np.ndarray:
+        """
+        Pixels as stored: (rows x pixels) uint8, or (rows x pixels/8) bits when packed
+        """
+        row_bytes = (self.num_features+7)//8 if self.packed else self.num_features
+        if self.num_rows == 0:
+            return np.zeros((0, row_bytes), dtype=np.uint8)
+        return np.memmap(os.path.join(self.store_dir, PIXELS_FILE_NAME), dtype=np.uint8, mode='r',
+                            shape=(self.num_rows, row_bytes))
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """
+        (rows x pixels) uint8 matrix, memory mapped unless the store is packed
+        """
+        if self._pixels is None:
+            if self.packed:
+                self._pixels = unpack_binary_images(self.raw_pixels, self.num_features)
+            else:
+                self._pixels = self.raw_pixels
+        return self._pixels
+
+    @property
+    def labels(self) -> np.ndarray:
+        return np.load(os.path.join(self.store_dir, LABELS_FILE_NAME), mmap_mode='r')
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        DataFrame with the same layout as the csv, the pixel block is not copied
+        """
+        df_data = pd.DataFrame(self.pixels, columns=self.columns, copy=False)
+        df_data[self.col_category] = np.asarray(self.labels)
+        return df_data
+
+    def fold_data(self, feature_indices:np.ndarray=None) -> FoldData:
+        """
+        Shared data to create folds (Fold.generate_k_folds accepts it instead of a DataFrame)
+
+        feature_indices: keep only these pixel columns (e.g. from feature_selection.select_features)
+        """
+        data = FoldData(self.pixels, self.labels, self.columns, self.col_category)
+        if feature_indices is not None:
+            data = data.select_features(feature_indices)
+        return data
+
+def load_store(store_dir:str) -> DatasetStore:
+    return DatasetStore(store_dir)
@@ -1,6 +1,10 @@
 import numpy as np
 import warnings
+import copy
 from abc import abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextvars
+from functools import partial
 import optuna
 import numpy as np
 from typing import List,Union
@@ -8,16 +12,144 @@ from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier
 
 from results import Fold, Result
-from method import MachineLearningMethod, ScikitLearnMachineLearning
+from method import MachineLearningMethod, ScikitLearnMachineLearning, RandomForestTreePool, HammingKNNMachineLearning
+from tracing import NULL_TRACER, Tracer
+
+class NoImprovementStopper():
+    def __init__(self, patience:int):
+        """
+        Optuna callback that stops a study after patience finished trials without improving the best value
+        """
+        self.patience = patience
+
+    def __call__(self, study:optuna.Study, trial:optuna.trial.FrozenTrial) -> None:
+        try:
+            best_number = study.best_trial.number
+        except ValueError:
+            # no completed trial yet
+            return
+        states = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+        num_without_improvement = len([t for t in study.get_trials(deepcopy=False, states=states) if t.number > best_number])
+        if num_without_improvement >= self.patience:
+            study.stop()
+
+# trials that count for num_trials (failed and interrupted trials are run again)
+FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+def create_storage(storage):
+    """
+    Optuna storage: None (in memory), a database URL (e.g. 'sqlite:///search.db'), a file name
+    for the journal file backend (for a shared filesystem, e.g. 'search.log') or a storage object
+    """
+    if isinstance(storage, str) and '://' not in storage:
+        from optuna.storages.journal import JournalFileBackend
+        return optuna.storages.JournalStorage(JournalFileBackend(storage))
+    return storage
+
+def fold_study_name(study_name:str, fold_number:int) -> str:
+    return f"{study_name}_fold_{fold_number}"
+
+def _evaluate_fold(fold:Fold, fold_number:int, ml_method:MachineLearningMethod, goal_category_optimization,
+                    num_trials:int, sampler, n_jobs_validation:int, cache=None,
+                    pruner=None, timeout:float=None, patience:int=None, tracer=NULL_TRACER,
+                    storage=None, study_name:str='experiment'):
+    """
+    Optimize (when goal_category_optimization is set) and evaluate a single outer fold.
+    It only depends on its arguments, so folds can run in any order or process.
+    With storage, the study of the fold (study_name + '_fold_' + fold_number) is resumed or
+    shared with other workers, only the trials still missing to reach num_trials are run
+    (the sampler is reseeded, so the trials are not repeatable).
+
+    Returns (result, study, best_method, cache_counts, fold_tracer), study is None without optimization,
+    cache_counts holds the (hits, misses) of the cache during this fold and fold_tracer its spans
+    """
+    cache_counts_before = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    tracer = tracer.new_child()
+    # seed to keep experiment remakeble
+    np.random.seed(1)
+    study = None
+    with tracer.tags(fold=fold_number), tracer.span('fold'):
+        if(goal_category_optimization is not None):
+            # every fold starts from the same sampler state
+            # without a pruner every trial evaluates all validation folds
+            pruner = copy.deepcopy(pruner) if pruner is not None else optuna.pruners.NopPruner()
+            sampler = copy.deepcopy(sampler)
+            study = optuna.create_study(sampler=sampler, pruner=pruner, direction='maximize',
+                                        storage=create_storage(storage), study_name=fold_study_name(study_name, fold_number),
+                                        load_if_exists=storage is not None)
+            optimization_goal = goal_category_optimization(fold)
+            optimization_goal.n_jobs = n_jobs_validation
+            optimization_goal.cache = cache
+            optimization_goal.tracer = tracer
+            callbacks = [NoImprovementStopper(patience)] if patience is not None else []
+
+            num_finished_trials = len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+            if storage is not None:
+                # every worker stops when the study (all workers together) has num_trials finished trials
+                callbacks.append(optuna.study.MaxTrialsCallback(num_trials, states=FINISHED_STATES))
+                # workers started together all see an empty study, with the same seed they would propose
+                # the same trials, so each worker (and each resumed run) samples with its own seed
+                sampler.reseed_rng()
+            if num_finished_trials < num_trials:
+                with tracer.span('search'):
+                    study.optimize(optimization_goal, n_trials=num_trials-num_finished_trials, timeout=timeout, callbacks=callbacks)
+
+            # the best trial may come from a previous run or another worker, so the method is rebuilt from its parameters
+            best_method = optimization_goal.get_method(optuna.trial.FixedTrial(study.best_trial.params, study.best_trial.number))
+        else:
+            best_method = ml_method
+
+        if cache is not None:
+            best_method.cache = cache
+        best_method.tracer = tracer
+        result = best_method.eval_fold(fold)
+        if cache is not None:
+            # best_method is kept (and may be saved), its model must not depend on the cache entry
+            try:
+                best_method.load_cached_model()
+            except FileNotFoundError:
+                # evicted (e.g. by another worker) since the hit: fitted again
+                best_method.cache = None
+                result = best_method.eval_fold(fold)
+                best_method.cache = cache
+        with tracer.span('score'):
+            result.macro_f1
+        best_method.tracer = NULL_TRACER
+
+    # the trees pool is only used by the search, no need to keep (or send back) its forests
+    if getattr(best_method, 'tree_pool', None) is not None:
+        best_method.tree_pool = None
+    cache_counts = (cache.hits - cache_counts_before[0], cache.misses - cache_counts_before[1]) if cache is not None else (0, 0)
+    return result, study, best_method, cache_counts, tracer
 
 class Experiment():
     def __init__(self,folds:List[Fold], ml_method:MachineLearningMethod,
                     goal_category_optimization=None,
-                    num_trials:int=100, sampler=optuna.samplers.TPESampler(seed=1, n_startup_trials=10)):
+                    num_trials:int=100, sampler=optuna.samplers.TPESampler(seed=1, n_startup_trials=10),
+                    n_jobs:int=1, n_jobs_validation:int=1, cache=None,
+                    pruner:optuna.pruners.BasePruner=None, timeout:float=None, patience:int=None,
+                    tracer:Tracer=None, storage=None, study_name:str='experiment'):
         """
         folds: folds defined for experiments
         ml_method: machile learning method to be used
         goal_category_optimization: objective class as optimization criterion for features
+        sampler: copied for every outer fold, so the search of each fold starts from the same state
+                 (and np.random.seed(1)) and the results do not depend on n_jobs
+        n_jobs: number of processes used to run the outer folds
+        n_jobs_validation: number of threads used to evaluate the validation folds of a trial, in waves of
+                           n_jobs_validation folds: the pruner can only stop a trial between waves (with
+                           n_jobs_validation >= number of validation folds every fold is evaluated)
+        cache: ModelCache to reuse models already fitted (with the same parameters) on the same folds
+        pruner: optuna pruner (e.g. MedianPruner, HyperbandPruner) to stop bad trials after some validation folds
+        timeout: maximum time (seconds) of the search of each fold, results are no longer repeatable when set
+        patience: stop the search of a fold after this number of trials without improvement
+        tracer: Tracer to record the time of each step (timings are also set as the trials' user attribute 'timings')
+        storage: keep the study of each fold in a database URL (e.g. 'sqlite:///search.db') or a journal file
+                 (e.g. 'search.log', also on a shared filesystem). An interrupted search is resumed and several
+                 processes or machines running the same Experiment split its trials. The sampler of each
+                 worker gets a random seed, so the seed of the sampler only makes runs without storage
+                 (a single worker) repeatable.
+        study_name: studies are named study_name + '_fold_' + fold number
         """
         self.folds = folds
         self._results = None
@@ -25,7 +157,17 @@ class Experiment():
         self.goal_category_optimization = goal_category_optimization
         self.num_trials = num_trials
         self.sampler = sampler
+        self.n_jobs = n_jobs
+        self.n_jobs_validation = n_jobs_validation
+        self.cache = cache
+        self.pruner = pruner
+        self.timeout = timeout
+        self.patience = patience
+        self.tracer = tracer if tracer is not None else NULL_TRACER
+        self.storage = storage
+        self.study_name = study_name
         self.studies_per_fold = []
+        self.best_methods_per_fold = []
 
     @property
     def results(self) -> List[Result]:
@@ -38,22 +180,33 @@ class Experiment():
         Retorns, for each fold, its result
         """
         self._results = []
+        self.studies_per_fold = []
+        # method evaluated on each fold (fitted, it can be saved and served)
+        self.best_methods_per_fold = []
         self.arr_validation_per_fold = [] # experiments de validation per fold
-        # seed to keep experiment remakeble
-        np.random.seed(1)
-        for i,fold in enumerate(self.folds):
-            if(self.goal_category_optimization is not None):
-                study = optuna.create_study(sampler=self.sampler, direction='maximize')
-                optimization_goal = self.goal_category_optimization(fold)
-                study.optimize(optimization_goal, n_trials=self.num_trials)
-
-                best_method = optimization_goal.arr_evaluated_methods[study.best_trial.number]
-                self.studies_per_fold.append(study)
-            else:
-                best_method = self.ml_method
 
-            result = best_method.eval(fold.df_practice,fold.df_data_to_predict,fold.col_category)
+        evaluate_fold = partial(_evaluate_fold, ml_method=self.ml_method,
+                                goal_category_optimization=self.goal_category_optimization,
+                                num_trials=self.num_trials, sampler=self.sampler,
+                                n_jobs_validation=self.n_jobs_validation, cache=self.cache,
+                                pruner=self.pruner, timeout=self.timeout, patience=self.patience,
+                                tracer=self.tracer, storage=self.storage, study_name=self.study_name)
+        if self.n_jobs > 1:
+            # each fold is independent, results come back in the folds order
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+                arr_fold_output = list(executor.map(evaluate_fold, self.folds, range(len(self.folds))))
+        else:
+            arr_fold_output = [evaluate_fold(fold, fold_number) for fold_number, fold in enumerate(self.folds)]
+
+        for result, study, best_method, cache_counts, fold_tracer in arr_fold_output:
+            self.tracer.merge(fold_tracer)
             self._results.append(result)
+            self.best_methods_per_fold.append(best_method)
+            if study is not None:
+                self.studies_per_fold.append(study)
+            if self.cache is not None and self.n_jobs > 1:
+                # hits and misses counted by the worker process
+                self.cache.add_counts(*cache_counts)
 
         return self._results
 
@@ -65,6 +218,13 @@ class Experiment():
         return np.mean([result.macro_f1 for result in self.results])
 
 class GoalOptimization:
+    # number of threads to evaluate the validation folds of a trial (set by Experiment)
+    n_jobs = 1
+    # ModelCache given to every evaluated method (set by Experiment)
+    cache = None
+    # Tracer of the experiment (set by Experiment)
+    tracer = NULL_TRACER
+
     def __init__(self,  fold: Fold):
         self.fold = fold
         self.arr_evaluated_methods = []
@@ -77,16 +237,61 @@ class GoalOptimization:
     def optimization_result(self,result:Result) -> float:
         raise NotImplementedError
 
+    def _eval_validation(self, method:MachineLearningMethod, num_fold:int, fold_validation:Fold) -> Result:
+        with self.tracer.tags(validation_fold=num_fold):
+            return method.eval_fold(fold_validation)
+
     def __call__(self, trial: optuna.Trial) -> float:
+        with self.tracer.tags(trial=trial.number), self.tracer.profile(trial.number):
+            try:
+                with self.tracer.span('trial'):
+                    return self._evaluate_trial(trial)
+            finally:
+                if self.tracer.enabled:
+                    # time per step (fit, predict...) of this trial
+                    trial.set_user_attr('timings', self.tracer.totals(**self.tracer.current_tags()))
+
+    def _evaluate_trial(self, trial: optuna.Trial) -> float:
         # for each fold, execute method and calculate result
         sum = 0
         method = self.get_method(trial)
+        if self.cache is not None:
+            method.cache = self.cache
+        method.tracer = self.tracer
         self.arr_evaluated_methods.append(method)
-        for fold_validation in self.fold.arr_folds_validation:
-            result = method.eval(fold_validation.df_practice,fold_validation.df_data_to_predict,self.fold.col_category)
-            sum += self.optimization_result(result)
 
-        return sum/len(self.fold.arr_folds_validation)
+        with self.tracer.span('validation_folds'):
+            arr_folds_validation = self.fold.arr_folds_validation
+
+        executor = None
+        arr_futures = {}
+        if self.n_jobs > 1:
+            executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+        try:
+            for num_fold, fold_validation in enumerate(arr_folds_validation):
+                if executor is not None:
+                    if num_fold % self.n_jobs == 0:
+                        # folds are submitted in waves of n_jobs, so a pruned trial does not evaluate the next waves
+                        # (each thread fits its own copy of the method and keeps the trace tags)
+                        arr_futures = {num: executor.submit(contextvars.copy_context().run, self._eval_validation,
+                                                            copy.deepcopy(method), num, arr_folds_validation[num])
+                                        for num in range(num_fold, min(num_fold+self.n_jobs, len(arr_folds_validation)))}
+                    result = arr_futures[num_fold].result()
+                else:
+                    result = self._eval_validation(method, num_fold, fold_validation)
+                with self.tracer.span('score', validation_fold=num_fold):
+                    sum += self.optimization_result(result)
+
+                # average so far, the pruner compares it with other trials at the same fold
+                trial.report(sum/(num_fold+1), num_fold)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            method.tracer = NULL_TRACER
+
+        return sum/len(arr_folds_validation)
 
 class GoalOptimizationDecisionTree(GoalOptimization):
     def __init__(self, fold:Fold):
@@ -103,17 +308,42 @@ class GoalOptimizationDecisionTree(GoalOptimization):
         return result.macro_f1
 
 class GoalOptimizationRandomForest(GoalOptimization):
-    def __init__(self, fold:Fold, num_max_trees:int=5):
+    def __init__(self, fold:Fold, num_max_trees:int=5, reuse_trees:bool=False, param_step:float=None):
+        """
+        reuse_trees: trials that differ only in num_trees share their fitted trees
+                     (e.g. Experiment(..., goal_category_optimization=partial(GoalOptimizationRandomForest, reuse_trees=True)))
+        param_step: min_samples_split and max_features are multiples of param_step (default 0.05 with reuse_trees,
+                    continuous otherwise), so different trials can suggest the same forest and share its trees
+        """
         super().__init__(fold)
         self.num_max_trees = num_max_trees
+        self.tree_pool = RandomForestTreePool() if reuse_trees else None
+        self.param_step = param_step if param_step is not None or not reuse_trees else 0.05
 
     def get_method(self,trial: optuna.Trial)->MachineLearningMethod:        
-        min_samples = trial.suggest_uniform('min_samples_split', 0, 0.5)
-        max_features = trial.suggest_uniform('max_features', 0, 0.5)
+        if self.param_step is not None:
+            # both must be above 0 for sklearn
+            min_samples = trial.suggest_float('min_samples_split', self.param_step, 0.5, step=self.param_step)
+            max_features = trial.suggest_float('max_features', self.param_step, 0.5, step=self.param_step)
+        else:
+            min_samples = trial.suggest_uniform('min_samples_split', 0, 0.5)
+            max_features = trial.suggest_uniform('max_features', 0, 0.5)
         num_trees = trial.suggest_int('num_trees', 1, self.num_max_trees)
         clf_rf = RandomForestClassifier(min_samples_split=min_samples,max_features=max_features,n_estimators=num_trees,random_state=2)
         
-        return ScikitLearnMachineLearning(clf_rf)
+        return ScikitLearnMachineLearning(clf_rf, tree_pool=self.tree_pool)
 
     def optimization_result(self, result:Result) ->float:
         return result.macro_f1
+
+class GoalOptimizationHammingKNN(GoalOptimization):
+    def __init__(self, fold:Fold, max_k:int=15):
+        super().__init__(fold)
+        self.max_k = max_k
+
+    def get_method(self, trial: optuna.Trial) -> MachineLearningMethod:
+        k = trial.suggest_int('k', 1, self.max_k)
+        return HammingKNNMachineLearning(k)
+
+    def optimization_result(self, result:Result) -> float:
+        return result.macro_f1
@@ -0,0 +1,90 @@
+import time
+import numpy as np
+import pandas as pd
+from typing import Union
+
+from information_gain import information_gain_matrix, discrete_information_gain_matrix
+from results import Fold, FoldData
+
+def _as_dataframe(df_data:Union[pd.DataFrame, FoldData], col_category:str) -> pd.DataFrame:
+    if isinstance(df_data, FoldData):
+        df_data = pd.DataFrame(df_data.x, columns=df_data.columns, copy=False).assign(**{col_category: df_data.y})
+    return df_data
+
+def rank_features(df_data:Union[pd.DataFrame, FoldData], col_category:str, num_bins:int=None) -> pd.Series:
+    """
+    Information gain of every feature, from the highest to the lowest.
+    For 0/1 (binary) pixels it is the mutual information between pixel and category.
+
+    df_data: DataFrame (or FoldData) with the features and the category
+    col_category: category column
+    num_bins: split each feature in num_bins intervals before (None uses every distinct value)
+    """
+    df_data = _as_dataframe(df_data, col_category)
+    if num_bins is None:
+        info_gain = information_gain_matrix(df_data, col_category)
+    else:
+        info_gain = discrete_information_gain_matrix(df_data, col_category, num_bins)
+    return info_gain.sort_values(ascending=False, kind='stable')
+
+def select_features(df_data:Union[pd.DataFrame, FoldData], col_category:str, top_k:int=None,
+                    threshold:float=None, num_bins:int=None) -> np.ndarray:
+    """
+    Positions (int32, ascending) of the features to keep, usable by FoldData.select_features,
+    DatasetStore.fold_data and filter_array_from_indices.
+
+    top_k: keep the top_k features with highest information gain
+    threshold: keep features whose information gain is at least threshold
+    (when both are set, a feature must satisfy both)
+    """
+    info_gain = rank_features(df_data, col_category, num_bins)
+    if threshold is not None:
+        info_gain = info_gain[info_gain >= threshold]
+    if top_k is not None:
+        info_gain = info_gain.iloc[:top_k]
+
+    feature_names = _as_dataframe(df_data, col_category).columns.drop(col_category)
+    return np.sort(feature_names.get_indexer(info_gain.index)).astype(np.int32)
+
+def crop_indices(start_row:int, start_column:int, last_row:int, last_column:int, square_reference:int=28) -> np.ndarray:
+    """
+    Positions of the pixels kept by create_filter_array (a rectangular window)
+    """
+    rows, columns = np.meshgrid(np.arange(start_row, last_row), np.arange(start_column, last_column), indexing='ij')
+    return (rows*square_reference + columns).ravel().astype(np.int32)
+
+def filter_array_from_indices(indices:np.ndarray, num_features:int=784) -> list:
+    """
+    Filter array (as create_filter_array) keeping the given features, to be used by create_selected_base
+    """
+    filtr_array = np.zeros(num_features, dtype=int)
+    filtr_array[indices] = 1
+    # key 2 to indicate the class
+    return filtr_array.tolist()+[2]
+
+def compare_with_crop(df_data:Union[pd.DataFrame, FoldData], col_category:str, ml_method, num_folds:int=5,
+                    top_k:int=400, num_bins:int=None, crop:tuple=(4, 4, 24, 24)) -> pd.DataFrame:
+    """
+    Macro f1, accuracy and fit time of ml_method with the crop of create_filter_array and with the
+    top_k features selected by information gain. The features are selected only with the practice
+    rows of each fold.
+
+    ml_method: MachineLearningMethod (e.g. ScikitLearnMachineLearning(DecisionTreeClassifier(random_state=2)))
+    crop: (start_row, start_column, last_row, last_column) of the window
+    """
+    data = df_data if isinstance(df_data, FoldData) else FoldData.from_dataframe(df_data, col_category)
+    arr_folds = Fold.generate_k_folds(data, num_folds, col_category)
+    cropped_data = data.select_features(crop_indices(*crop))
+
+    arr_rows = []
+    for fold in arr_folds:
+        practice_data = FoldData(data.x[fold.practice_indices], data.y[fold.practice_indices], data.columns, col_category)
+        selected_data = data.select_features(select_features(practice_data, col_category, top_k=top_k, num_bins=num_bins))
+
+        for name, fold_data in (('crop', cropped_data), ('information_gain', selected_data)):
+            start = time.perf_counter()
+            result = ml_method.eval_fold(Fold.from_indices(fold_data, fold.practice_indices, fold.predict_indices))
+            arr_rows.append({'selection': name, 'num_features': len(fold_data.columns), 'macro_f1': result.macro_f1,
+                            'accuracy': result.accuracy, 'time_s': time.perf_counter() - start})
+
+    return pd.DataFrame(arr_rows).groupby('selection').mean()
@@ -0,0 +1,179 @@
+import numpy as np
+from itertools import islice
+from typing import Iterator, List, TextIO
+
+# text of every pixel value followed by a comma, left aligned and padded with zero bytes
+# e.g. 7 -> b'7,\x00\x00', 255 -> b'255,'
+_PIXEL_TEXT = np.array([(str(value)+',').encode() for value in range(256)], dtype='S4').view(np.uint8).reshape(256, 4)
+
+class DataChunk():
+    def __init__(self, pixels:np.ndarray, labels:np.ndarray, missing:np.ndarray, missing_labels:np.ndarray):
+        """
+        A block of consecutive rows of a pixel file.
+
+        pixels: uint8 matrix (rows x pixel columns)
+        labels: category of each row (last column of the file)
+        missing: bool matrix, True where a cell was empty or not a pixel value (0..255)
+        missing_labels: bool vector, True where the category could not be read
+        """
+        self.pixels = pixels
+        self.labels = labels
+        self.missing = missing
+        self.missing_labels = missing_labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def take(self, rows:np.ndarray) -> "DataChunk":
+        return DataChunk(self.pixels[rows], self.labels[rows], self.missing[rows], self.missing_labels[rows])
+
+
+def filter_indices(filtr_array:list) -> np.ndarray:
+    """
+    Positions of the pixels kept by a filter array (created by create_filter_array)
+    """
+    return np.flatnonzero(np.asarray(filtr_array) == 1)
+
+def crop_pixels(pixels:np.ndarray, filtr_array:list) -> np.ndarray:
+    """
+    Keep only the pixel columns marked with 1 in filtr_array
+    """
+    return pixels[:, filter_indices(filtr_array)]
+
+def binarize_pixels(pixels:np.ndarray, threshold:int=0) -> np.ndarray:
+    """
+    Pixels above threshold become 1, the others 0
+    """
+    return (pixels > threshold).astype(np.uint8)
+
+def preprocess_pixels(pixels:np.ndarray, filtr_array:list=None, binary:bool=False) -> np.ndarray:
+    """
+    Images (n x 784) transformed as the training files: crop (create_selected_base), then
+    binarization (create_binary_base). Used to predict images that are not in a file.
+
+    filtr_array: pixels used by the model (create_filter_array), None to keep all
+    binary: pixels above 0 become 1
+    """
+    if filtr_array is not None:
+        pixels = crop_pixels(pixels, filtr_array)
+    if binary:
+        pixels = binarize_pixels(pixels)
+    return pixels
+
+
+class Stage():
+    """
+    A step of the pipeline. It receives a DataChunk and returns the transformed one.
+    """
+    def columns(self, pixel_columns:List[str]) -> List[str]:
+        # names of the pixel columns after this stage
+        return pixel_columns
+
+    def __call__(self, chunk:DataChunk) -> DataChunk:
+        raise NotImplementedError
+
+class CropStage(Stage):
+    def __init__(self, filtr_array:list):
+        self.indices = filter_indices(filtr_array)
+
+    def columns(self, pixel_columns:List[str]) -> List[str]:
+        return [pixel_columns[i] for i in self.indices]
+
+    def __call__(self, chunk:DataChunk) -> DataChunk:
+        return DataChunk(chunk.pixels[:, self.indices], chunk.labels, chunk.missing[:, self.indices], chunk.missing_labels)
+
+class BinarizeStage(Stage):
+    def __init__(self, threshold:int=0):
+        self.threshold = threshold
+
+    def __call__(self, chunk:DataChunk) -> DataChunk:
+        return DataChunk(binarize_pixels(chunk.pixels, self.threshold), chunk.labels, chunk.missing, chunk.missing_labels)
+
+class DropMissingStage(Stage):
+    """
+    Remove rows with any missing (NaN, empty or invalid) cell
+    """
+    def __call__(self, chunk:DataChunk) -> DataChunk:
+        valid = ~(chunk.missing.any(axis=1) | chunk.missing_labels)
+        if valid.all():
+            return chunk
+        return chunk.take(valid)
+
+
+def _parse_lines(lines:List[str], num_columns:int) -> np.ndarray:
+    """
+    Slow path, used only when a chunk has invalid cells.
+    Invalid cells (and every cell of rows with a wrong number of columns) become -1.
+    """
+    values = np.full((len(lines), num_columns), -1, dtype=np.int64)
+    for i, line in enumerate(lines):
+        items = line.rstrip('\r\n').split(',')
+        if len(items) != num_columns:
+            continue
+        for j, item in enumerate(items):
+            try:
+                val = float(item)
+            except ValueError:
+                continue
+            if val.is_integer():
+                values[i, j] = int(val)
+    return values
+
+def _parse_chunk(lines:List[str], num_columns:int) -> DataChunk:
+    try:
+        values = np.loadtxt(lines, delimiter=',', dtype=np.int64, ndmin=2)
+        if values.shape[1] != num_columns:
+            raise ValueError
+    except ValueError:
+        values = _parse_lines(lines, num_columns)
+
+    pixels = values[:, :-1]
+    missing = (pixels < 0) | (pixels > 255)
+    return DataChunk(np.where(missing, 0, pixels).astype(np.uint8), values[:, -1], missing, values[:, -1] < 0)
+
+def read_chunks(file:TextIO, num_columns:int, chunk_size:int=4096) -> Iterator[DataChunk]:
+    """
+    Read the rows (after the header) of an open pixel file, chunk_size rows at a time
+    """
+    while True:
+        lines = [line for line in islice(file, chunk_size) if line.strip()]
+        if not lines:
+            break
+        yield _parse_chunk(lines, num_columns)
+
+def format_chunk(chunk:DataChunk) -> bytes:
+    """
+    CSV text of a chunk: pixels followed by the category, one row per line
+    """
+    num_rows = len(chunk)
+    if num_rows == 0:
+        return b''
+    cells = _PIXEL_TEXT[chunk.pixels].reshape(num_rows, -1)
+
+    labels = np.array([(str(label)+'\n').encode() for label in chunk.labels.tolist()])
+    labels = labels.view(np.uint8).reshape(num_rows, -1)
+
+    # drop the padding bytes and keep everything else in row order
+    text = np.concatenate((cells, labels), axis=1).ravel()
+    return text[text != 0].tobytes()
+
+def run_pipeline(input_file_name:str, output_file_name:str, stages:List[Stage], chunk_size:int=4096) -> None:
+    """
+    Stream input_file_name through stages and write the result in output_file_name.
+    Only chunk_size rows are kept in memory at a time.
+
+    input_file_name: csv with pixel columns followed by the category column (with header)
+    output_file_name: csv with the same layout
+    stages: transformations applied, in order, to every chunk
+    """
+    with open(input_file_name, 'r') as file, open(output_file_name, 'wb') as new_file:
+        header = file.readline().rstrip('\r\n').split(',')
+        pixel_columns, col_category = header[:-1], header[-1]
+        for stage in stages:
+            pixel_columns = stage.columns(pixel_columns)
+        new_file.write((','.join(pixel_columns + [col_category])+'\n').encode())
+
+        for chunk in read_chunks(file, len(header), chunk_size):
+            for stage in stages:
+                chunk = stage(chunk)
+            new_file.write(format_chunk(chunk))
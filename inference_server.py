@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+import numpy as np
+from typing import List, Optional, Tuple
+
+from file_pipeline import preprocess_pixels
+
+SQUARE_REFERENCE = 28
+NUM_PIXELS = SQUARE_REFERENCE*SQUARE_REFERENCE
+
+class LatencyStats():
+    def __init__(self, max_samples:int=10000):
+        """
+        Latency (of the last max_samples requests) and throughput counters
+        """
+        self.latencies = deque(maxlen=max_samples)
+        self.start_time = time.perf_counter()
+        self.num_requests = 0
+        self.num_images = 0
+        self.num_batches = 0
+
+    def add_request(self, latency:float, num_images:int) -> None:
+        self.latencies.append(latency)
+        self.num_requests += 1
+        self.num_images += num_images
+
+    def as_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.start_time
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {'requests': self.num_requests, 'images': self.num_images, 'batches': self.num_batches,
+                'mean_batch_size': self.num_images/self.num_batches if self.num_batches else 0.0,
+                'latency_p50_ms': float(np.percentile(latencies, 50))*1000,
+                'latency_p99_ms': float(np.percentile(latencies, 99))*1000,
+                'images_per_second': self.num_images/elapsed if elapsed > 0 else 0.0}
+
+class InferenceServer():
+    def __init__(self, method, filtr_array:list=None, binary:bool=False,
+                max_batch_size:int=256, max_delay:float=0.002):
+        """
+        Serve predictions of a fitted MachineLearningMethod, grouping concurrent requests in batches.
+
+        method: fitted MachineLearningMethod (e.g. MachineLearningMethod.load('model.joblib'))
+        filtr_array: pixels used by the model (create_filter_array), None to use all
+        binary: transform pixels to 0 or 1 (as create_binary_base)
+        max_batch_size: maximum number of images predicted at once
+        max_delay: maximum time (seconds) a request waits for others to fill a batch
+        """
+        self.method = method
+        self.filtr_array = filtr_array
+        self.binary = binary
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.stats = LatencyStats()
+        self._queue = None
+        self._batch_task = None
+
+    def preprocess(self, images:np.ndarray) -> np.ndarray:
+        # the same transformations used to create the training files
+        return preprocess_pixels(images, self.filtr_array, self.binary)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._batch_task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def stop(self) -> None:
+        if self._batch_task is not None:
+            self._batch_task.cancel()
+
+    async def predict(self, images:np.ndarray) -> np.ndarray:
+        """
+        Categories of images (n x 784 uint8), predicted together with other concurrent requests
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((images, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        # wait for a request, then for others until the batch is full or max_delay expires
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        num_images = len(batch[0][0])
+        deadline = loop.time() + self.max_delay
+        while num_images < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            num_images += len(item[0])
+        return batch
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            images = np.concatenate([item[0] for item in batch])
+            try:
+                # the model runs in a thread so the loop keeps receiving requests
+                predictions = await loop.run_in_executor(None, lambda: self.method.predict(self.preprocess(images)))
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            self.stats.num_batches += 1
+            ini = 0
+            for item_images, future in batch:
+                if not future.done():
+                    future.set_result(predictions[ini:ini+len(item_images)])
+                ini += len(item_images)
+
+    @staticmethod
+    def parse_images(body:bytes, content_type:str) -> np.ndarray:
+        """
+        Images of a request: raw bytes (n x 784 uint8) or json {"images": [...]} where each
+        image is a 28x28 or a 784 list of values 0..255. Raises ValueError when there is no image.
+        """
+        if content_type.startswith('application/octet-stream'):
+            if len(body) == 0 or len(body) % NUM_PIXELS != 0:
+                raise ValueError(f"body size must be a non-zero multiple of {NUM_PIXELS}")
+            return np.frombuffer(body, dtype=np.uint8).reshape(-1, NUM_PIXELS)
+
+        images = np.asarray(json.loads(body)['images'])
+        if images.ndim == 0 or len(images) == 0:
+            raise ValueError("the request has no images")
+        images = images.reshape(len(images), -1)
+        if images.shape[1] != NUM_PIXELS or images.min(initial=0) < 0 or images.max(initial=0) > 255:
+            raise ValueError(f"each image must have {NUM_PIXELS} values between 0 and 255")
+        return images.astype(np.uint8)
+
+    async def _respond(self, writer:asyncio.StreamWriter, status:str, content:dict, keep_alive:bool) -> None:
+        body = json.dumps(content).encode()
+        header = (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(header.encode()+body)
+        await writer.drain()
+
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        """
+        Minimal HTTP/1.1: POST /predict and GET /stats, with keep-alive
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                if method == 'GET' and path == '/stats':
+                    await self._respond(writer, '200 OK', self.stats.as_dict(), keep_alive)
+                elif method == 'POST' and path == '/predict':
+                    start = time.perf_counter()
+                    try:
+                        images = self.parse_images(body, headers.get('content-type', 'application/json'))
+                    except (ValueError, KeyError, TypeError) as error:
+                        await self._respond(writer, '400 Bad Request', {'error': str(error)}, keep_alive)
+                    else:
+                        try:
+                            predictions = await self.predict(images)
+                        except Exception as error:
+                            # a failure of the model (set on the future by _batch_loop), the connection stays usable
+                            await self._respond(writer, '500 Internal Server Error',
+                                                {'error': f"{type(error).__name__}: {error}"}, keep_alive)
+                        else:
+                            self.stats.add_request(time.perf_counter() - start, len(images))
+                            await self._respond(writer, '200 OK', {'predictions': np.asarray(predictions).tolist()}, keep_alive)
+                else:
+                    await self._respond(writer, '404 Not Found', {'error': f"{method} {path}"}, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host:str='127.0.0.1', port:int=8000, unix_socket:Optional[str]=None) -> None:
+        await self.start()
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+def main(args:List[str]=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve a saved MachineLearningMethod over HTTP")
+    parser.add_argument('model', help="file written by MachineLearningMethod.save")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help="listen on a unix socket instead of host:port")
+    parser.add_argument('--crop', type=int, nargs=4, metavar=('START_ROW', 'START_COLUMN', 'LAST_ROW', 'LAST_COLUMN'),
+                        help="pixels used by the model (as create_filter_array)")
+    parser.add_argument('--binary', action='store_true', help="transform pixels to 0 or 1")
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    options = parser.parse_args(args)
+
+    from method import MachineLearningMethod
+    from work_methods import create_filter_array
+    filtr_array = None
+    if options.crop is not None:
+        start_row, start_column, last_row, last_column = options.crop
+        filtr_array = create_filter_array(SQUARE_REFERENCE, start_row, start_column, last_row, last_column)
+
+    server = InferenceServer(MachineLearningMethod.load(options.model), filtr_array, options.binary,
+                            options.max_batch_size, options.max_delay_ms/1000)
+    asyncio.run(server.serve(options.host, options.port, options.unix_socket))
+
+if __name__ == '__main__':
+    main()
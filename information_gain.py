@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import math
 from typing import Union
 
@@ -92,3 +93,147 @@ def discrete_information_gain(df_data:pd.DataFrame, name_col_category:str, featu
         val_info_gain += val_prob * conditional_information_gain(df, val_entropy_y, name_col_category, 'discretized_feature', val_bin)
 
     return val_info_gain
+
+
+def _category_codes(df_data:pd.DataFrame, name_col_category:str):
+    """
+        Return (codes, num_categories) for the category column.
+        Rows whose category is missing get code -1.
+    """
+    codes, uniques = pd.factorize(df_data[name_col_category])
+    return codes, len(uniques)
+
+
+def _feature_codes(values:np.ndarray):
+    """
+        Map every cell of a feature matrix (rows x features) to an integer code.
+        Codes are shared by all columns, so the same value has the same code in every feature.
+        Missing cells get code -1.
+
+        Returns (codes, num_values)
+    """
+    if values.dtype.kind in 'iub':
+        # integers (e.g. pixels 0..255) can be used directly after shifting by the minimum
+        val_min = int(values.min()) if values.size else 0
+        val_max = int(values.max()) if values.size else 0
+        return values.astype(np.int64) - val_min, val_max - val_min + 1
+
+    codes, uniques = pd.factorize(values.ravel())
+    return codes.reshape(values.shape), len(uniques)
+
+
+def _contingency_counts(codes:np.ndarray, num_values:int, category_codes:np.ndarray, num_categories:int, chunk_size:int) -> np.ndarray:
+    """
+        Build the joint counts (feature, feature value, category) for all features at once.
+        The rows are processed in chunks so the temporary index array stays small.
+    """
+    num_rows, num_features = codes.shape
+    num_cells = num_features*num_values*num_categories
+    counts = np.zeros(num_cells, dtype=np.int64)
+
+    # offset of each feature inside the flattened counts
+    feature_offset = np.arange(num_features, dtype=np.int64)*num_values*num_categories
+
+    for ini in range(0, num_rows, chunk_size):
+        chunk_codes = codes[ini:ini+chunk_size]
+        chunk_category = category_codes[ini:ini+chunk_size]
+
+        joint = feature_offset + chunk_codes*num_categories + chunk_category[:, np.newaxis]
+
+        # drop missing values (feature or category)
+        valid = (chunk_codes >= 0) & (chunk_category[:, np.newaxis] >= 0)
+        counts += np.bincount(joint[valid], minlength=num_cells)
+
+    return counts.reshape(num_features, num_values, num_categories)
+
+
+def _information_gain_from_counts(counts:np.ndarray, val_entropy_y:float, num_total:int) -> np.ndarray:
+    """
+        IG(Y|feature) = sum_v P(feature=v) * (entropy(Y) - entropy(Y|feature=v)) for every feature.
+
+        counts: joint counts with shape (features, feature values, categories)
+    """
+    # amount of instances for each (feature, value)
+    num_per_value = counts.sum(axis=2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        val_prob = counts/num_per_value[:, :, np.newaxis]
+        conditional_entropy = -np.sum(np.where(counts > 0, val_prob*np.log2(val_prob), 0.0), axis=2)
+
+    val_info_gain = (num_per_value/num_total)*(val_entropy_y - conditional_entropy)
+    return val_info_gain.sum(axis=1)
+
+
+def _entropy_from_codes(category_codes:np.ndarray, num_categories:int, num_total:int) -> float:
+    amount_count_col = np.bincount(category_codes[category_codes >= 0], minlength=num_categories)
+    amount_count_col = amount_count_col[amount_count_col > 0]
+    val_prob = amount_count_col/num_total
+    return float(-np.sum(val_prob*np.log2(val_prob)))
+
+
+def information_gain_matrix(df_data:pd.DataFrame, name_col_category:str, chunk_size:int=4096) -> pd.Series:
+    """
+        Calculate IG(Y| feature) for every feature of df_data in a single pass.
+        Returns the same values as information_gain, one per column (indexed by feature name).
+
+        df_data: Data to be analysed
+        name_col_category: name of column which represent a category
+        chunk_size: number of rows processed at once (bounds the temporary memory)
+    """
+    feature_names = df_data.columns.drop(name_col_category)
+    category_codes, num_categories = _category_codes(df_data, name_col_category)
+    codes, num_values = _feature_codes(df_data[feature_names].to_numpy())
+
+    num_total = len(df_data)
+    val_entropy_y = _entropy_from_codes(category_codes, num_categories, num_total)
+    counts = _contingency_counts(codes, num_values, category_codes, num_categories, chunk_size)
+
+    return pd.Series(_information_gain_from_counts(counts, val_entropy_y, num_total), index=feature_names, name='Information Gain')
+
+
+def _discretize(values:np.ndarray, num_bins:int) -> np.ndarray:
+    """
+        Same intervals as pd.cut(values, bins=num_bins), computed for every column at once.
+        Returns the bin code of each cell (-1 when missing).
+    """
+    values = values.astype(np.float64)
+    val_min = np.nanmin(values, axis=0)
+    val_max = np.nanmax(values, axis=0)
+
+    # pd.cut widens a constant column by 0.1% on both sides
+    constant = val_min == val_max
+    widen = np.where(val_min != 0, 0.001*np.abs(val_min), 0.001)
+    val_min = np.where(constant, val_min - widen, val_min)
+    val_max = np.where(constant, val_max + widen, val_max)
+
+    # edges: (bins+1, features). pd.cut extends the first edge by 0.1% of the range
+    edges = np.linspace(val_min, val_max, num_bins + 1)
+    edges[0] -= np.where(constant, 0, (val_max - val_min)*0.001)
+
+    # intervals are closed on the right: (edge_i, edge_i+1]
+    codes = np.zeros(values.shape, dtype=np.int64)
+    for inner_edge in edges[1:-1]:
+        codes += values > inner_edge
+    codes[np.isnan(values)] = -1
+    return codes
+
+
+def discrete_information_gain_matrix(df_data:pd.DataFrame, name_col_category:str, num_bins:int, chunk_size:int=4096) -> pd.Series:
+    """
+        Calculate IG(Y| feature) for every feature of df_data, after splitting each one in num_bins intervals.
+        Returns the same values as discrete_information_gain, one per column (indexed by feature name).
+
+        df_data: Data to be analysed
+        name_col_category: name of column which represent a category
+        num_bins: number of intervals to discrete feature
+        chunk_size: number of rows processed at once (bounds the temporary memory)
+    """
+    feature_names = df_data.columns.drop(name_col_category)
+    category_codes, num_categories = _category_codes(df_data, name_col_category)
+    codes = _discretize(df_data[feature_names].to_numpy(), num_bins)
+
+    num_total = len(df_data)
+    val_entropy_y = _entropy_from_codes(category_codes, num_categories, num_total)
+    counts = _contingency_counts(codes, num_bins, category_codes, num_categories, chunk_size)
+
+    return pd.Series(_information_gain_from_counts(counts, val_entropy_y, num_total), index=feature_names, name='Information Gain')
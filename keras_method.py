@@ -0,0 +1,229 @@
+import os
+import tempfile
+import warnings
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict
+
+from method import MachineLearningMethod
+from results import Result, Fold
+
+# tensorflow is imported (and its threads configured) only when a network is built,
+# so importing this module stays as light as the other methods
+
+def _tensorflow(num_threads:int=None):
+    import tensorflow as tf
+    if num_threads is not None:
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(min(num_threads, 2))
+        except RuntimeError:
+            # the runtime was already started (by another network of this process), it keeps its threads
+            if tf.config.threading.get_intra_op_parallelism_threads() != num_threads:
+                warnings.warn(f"tensorflow is already running, num_threads={num_threads} was not applied")
+    return tf
+
+# architectures of cnn_cnn_dropout_ic.ipynb, side x side images (28 for the full image, 20 for the crop)
+
+def dense_network(side:int, num_categories:int):
+    from keras import Input, Model, layers
+    entrada = Input(shape=(side, side, 1), name="Entrada")
+    achatar = layers.Flatten(name="Achatar")(entrada)
+    camada_um = layers.Dense(128, activation="relu", name="Camada1")(achatar)
+    camada_dois = layers.Dense(64, activation="relu", name="Camada2")(camada_um)
+    camada_tres = layers.Dense(16, activation="relu", name="Camada3")(camada_dois)
+    saida = layers.Dense(num_categories, activation="softmax", name="Saida")(camada_tres)
+    return Model(inputs=entrada, outputs=saida, name="Rede_Neural_Totalmente_Conectada")
+
+def _cnn(side:int, num_categories:int, dropout:float):
+    from keras import Input, Sequential
+    from keras.layers import Conv2D, MaxPooling2D, Dropout, Dense, Flatten
+    model = Sequential([Input(shape=(side, side, 1))])
+    for num_filters in (32, 64, 128):
+        model.add(Conv2D(num_filters, (3, 3), activation='relu', kernel_initializer='he_uniform', padding='same'))
+        model.add(Conv2D(num_filters, (3, 3), activation='relu', kernel_initializer='he_uniform', padding='same'))
+        model.add(MaxPooling2D((2, 2)))
+        if dropout > 0:
+            model.add(Dropout(dropout))
+    model.add(Flatten())
+    model.add(Dense(128, activation='relu', kernel_initializer='he_uniform'))
+    if dropout > 0:
+        model.add(Dropout(dropout))
+    model.add(Dense(num_categories, activation='softmax'))
+    return model
+
+def cnn_basica(side:int, num_categories:int):
+    return _cnn(side, num_categories, 0)
+
+def cnn_dropout(side:int, num_categories:int):
+    return _cnn(side, num_categories, 0.2)
+
+ARCHITECTURES:Dict[str, Callable] = {
+    'dense': dense_network,
+    'cnn_basica': cnn_basica,
+    'cnn_dropout': cnn_dropout,
+}
+
+class KerasMachineLearning(MachineLearningMethod):
+    def __init__(self, architecture:str='cnn_basica', epochs:int=10, batch_size:int=64,
+                predict_batch_size:int=1024, num_threads:int=None, quantize:bool=False,
+                num_calibration_batches:int=20, seed:int=1):
+        """
+        Networks of cnn_cnn_dropout_ic.ipynb trained and evaluated on folds.
+        Images are read batch by batch (as uint8, scaled to [0, 1] inside the pipeline) from the
+        shared fold data, so there is no float copy of the dataset.
+
+        architecture: key of ARCHITECTURES ('dense', 'cnn_basica' or 'cnn_dropout')
+        batch_size: images per training step
+        predict_batch_size: images per inference step
+        num_threads: threads used by tensorflow (None: tensorflow default, all cores)
+        quantize: after training, predict with an int8 TFLite model (post-training quantization
+                  calibrated with num_calibration_batches practice batches)
+        """
+        if architecture not in ARCHITECTURES:
+            raise ValueError(f"architecture must be one of {list(ARCHITECTURES)}")
+        self.architecture = architecture
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.predict_batch_size = predict_batch_size
+        self.num_threads = num_threads
+        self.quantize = quantize
+        self.num_calibration_batches = num_calibration_batches
+        self.seed = seed
+        self.model = None
+        self.labels = None
+        self.tflite_model = None
+        self._interpreter = None
+
+    def __getstate__(self):
+        # the keras model is kept as the bytes of a .keras file, the interpreter is recreated
+        state = self.__dict__.copy()
+        state['_interpreter'] = None
+        if self.model is not None:
+            with tempfile.TemporaryDirectory() as directory:
+                file_name = os.path.join(directory, 'model.keras')
+                self.model.save(file_name)
+                with open(file_name, 'rb') as file:
+                    state['model'] = file.read()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.model, bytes):
+            import keras
+            _tensorflow(self.num_threads)
+            with tempfile.TemporaryDirectory() as directory:
+                file_name = os.path.join(directory, 'model.keras')
+                with open(file_name, 'wb') as file:
+                    file.write(self.model)
+                self.model = keras.models.load_model(file_name)
+
+    @staticmethod
+    def _side(num_features:int) -> int:
+        side = int(round(np.sqrt(num_features)))
+        if side*side != num_features:
+            raise ValueError(f"{num_features} features are not a square image")
+        return side
+
+    def _dataset(self, x:np.ndarray, indices:np.ndarray, batch_size:int, y_codes:np.ndarray=None, shuffle:bool=False):
+        """
+        Batches of the rows indices of x (and their category codes), prefetched while the model runs
+        """
+        tf = _tensorflow(self.num_threads)
+        side = self._side(x.shape[1])
+        dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype=np.int64))
+        if shuffle:
+            dataset = dataset.shuffle(len(indices), seed=self.seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+
+        def gather(batch_indices):
+            # only this batch is copied from the (possibly memory-mapped) uint8 data
+            pixels = np.asarray(x[batch_indices], dtype=np.uint8)
+            codes = y_codes[batch_indices] if y_codes is not None else np.zeros(len(batch_indices), dtype=np.int64)
+            return pixels, codes
+
+        def to_images(batch_indices):
+            pixels, codes = tf.numpy_function(gather, [batch_indices], (tf.uint8, tf.int64))
+            images = tf.reshape(tf.cast(pixels, tf.float32)/255.0, (-1, side, side, 1))
+            return images, tf.reshape(codes, (-1,))
+
+        dataset = dataset.map(to_images, num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def fit(self, x:np.ndarray, y:np.ndarray, indices:np.ndarray=None) -> "KerasMachineLearning":
+        """
+        x: uint8 pixel matrix (rows x pixels), y: category of each row
+        indices: rows of x used (default all)
+        """
+        tf = _tensorflow(self.num_threads)
+        import keras
+        indices = np.arange(len(y)) if indices is None else np.asarray(indices)
+        self.labels, codes = np.unique(np.asarray(y)[indices], return_inverse=True)
+        y_codes = np.zeros(len(y), dtype=np.int64)
+        y_codes[indices] = codes
+
+        keras.utils.set_random_seed(self.seed)
+        self.model = ARCHITECTURES[self.architecture](self._side(x.shape[1]), len(self.labels))
+        self.model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        self.model.fit(self._dataset(x, indices, self.batch_size, y_codes, shuffle=True), epochs=self.epochs, verbose=0)
+
+        self.tflite_model = None
+        self._interpreter = None
+        if self.quantize:
+            self.tflite_model = self._quantize(tf, x, indices)
+        return self
+
+    def _quantize(self, tf, x:np.ndarray, indices:np.ndarray) -> bytes:
+        def representative_dataset():
+            for images, _ in self._dataset(x, indices, 1, shuffle=True).take(self.num_calibration_batches*self.batch_size):
+                yield [images]
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        return converter.convert()
+
+    def _predict_quantized(self, dataset) -> np.ndarray:
+        tf = _tensorflow(self.num_threads)
+        if self._interpreter is None:
+            self._interpreter = tf.lite.Interpreter(model_content=self.tflite_model, num_threads=self.num_threads)
+        input_detail = self._interpreter.get_input_details()[0]
+        output_index = self._interpreter.get_output_details()[0]['index']
+        arr_codes = []
+        for images, _ in dataset.as_numpy_iterator():
+            if tuple(input_detail['shape']) != images.shape:
+                self._interpreter.resize_tensor_input(input_detail['index'], images.shape)
+                self._interpreter.allocate_tensors()
+                input_detail = self._interpreter.get_input_details()[0]
+            self._interpreter.set_tensor(input_detail['index'], images)
+            self._interpreter.invoke()
+            arr_codes.append(self._interpreter.get_tensor(output_index).argmax(axis=1))
+        return np.concatenate(arr_codes) if arr_codes else np.zeros(0, dtype=np.int64)
+
+    def predict_rows(self, x:np.ndarray, indices:np.ndarray) -> np.ndarray:
+        """
+        Categories of the given rows of x
+        """
+        if self.model is None:
+            raise ValueError("The method has no fitted model, call fit or eval first")
+        dataset = self._dataset(x, indices, self.predict_batch_size)
+        if self.tflite_model is not None:
+            codes = self._predict_quantized(dataset)
+        else:
+            codes = self.model.predict(dataset, verbose=0).argmax(axis=1)
+        return self.labels[codes]
+
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        x = np.asarray(x)
+        return self.predict_rows(x, np.arange(len(x)))
+
+    def eval(self, df_practice:pd.DataFrame, df_data_to_predict:pd.DataFrame, col_category:str) -> Result:
+        return self.eval_fold(Fold(df_practice, df_data_to_predict, col_category))
+
+    def eval_fold(self, fold:Fold) -> Result:
+        # rows are read by index from the data shared by every fold
+        with self.tracer.span('fit'):
+            self.fit(fold.data.x, fold.data.y, fold.practice_indices)
+        with self.tracer.span('predict'):
+            y_predictions = self.predict_rows(fold.data.x, fold.predict_indices)
+        return Result(fold.y_to_predict, y_predictions)
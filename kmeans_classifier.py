@@ -0,0 +1,52 @@
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import MiniBatchKMeans
+
+class MiniBatchKMeansClassifier(BaseEstimator, ClassifierMixin):
+    def __init__(self, n_clusters_per_class:int=10, random_state:int=1):
+        """
+        Nearest centroid classifier with MiniBatchKMeans centroids per category, trained with partial_fit.
+        Rows of a category are buffered until there are n_clusters_per_class of them.
+        """
+        self.n_clusters_per_class = n_clusters_per_class
+        self.random_state = random_state
+
+    def partial_fit(self, x:np.ndarray, y:np.ndarray, classes:np.ndarray=None) -> "MiniBatchKMeansClassifier":
+        if not hasattr(self, 'kmeans_'):
+            self.classes_ = np.unique(np.asarray(y) if classes is None else np.asarray(classes))
+            self.kmeans_ = {}
+            self.buffers_ = {}
+        for category in np.unique(y):
+            rows = x[y == category]
+            if category in self.kmeans_:
+                self.kmeans_[category].partial_fit(rows)
+                continue
+            # MiniBatchKMeans needs at least n_clusters rows on its first call
+            buffer = np.concatenate((self.buffers_[category], rows)) if category in self.buffers_ else rows
+            if len(buffer) < self.n_clusters_per_class:
+                self.buffers_[category] = buffer
+            else:
+                self.kmeans_[category] = MiniBatchKMeans(self.n_clusters_per_class, random_state=self.random_state,
+                                                        n_init=1).partial_fit(buffer)
+                self.buffers_.pop(category, None)
+        return self
+
+    def fit(self, x:np.ndarray, y:np.ndarray) -> "MiniBatchKMeansClassifier":
+        for attribute in ('kmeans_', 'buffers_'):
+            self.__dict__.pop(attribute, None)
+        return self.partial_fit(x, y)
+
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        arr_centroids = []
+        arr_categories = []
+        for category in self.classes_:
+            # categories with too few rows use the rows themselves as centroids
+            centroids = self.kmeans_[category].cluster_centers_ if category in self.kmeans_ else self.buffers_.get(category)
+            if centroids is not None:
+                arr_centroids.append(centroids)
+                arr_categories.append(np.full(len(centroids), category))
+        centroids = np.concatenate(arr_centroids).astype(np.float32)
+        x = np.asarray(x, dtype=np.float32)
+        # squared distance without the |x|^2 term, which is the same for every centroid
+        distances = (centroids**2).sum(axis=1)[np.newaxis, :] - 2*x @ centroids.T
+        return np.concatenate(arr_categories)[distances.argmin(axis=1)]
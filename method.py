@@ -1,20 +1,175 @@
 from abc import abstractmethod
-from results import Result
+from collections import OrderedDict
+import copy
+import threading
+import numpy as np
+from results import Result, Fold
 import pandas as pd
-from sklearn.base import ClassifierMixin, RegressorMixin
-from typing import List,Union
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Tuple, Union
+
+from dataset_store import pack_binary_images
+from tracing import NULL_TRACER
+
+# sklearn is only imported by the methods that use it, so loading a saved Hamming k-NN or
+# Keras method (e.g. cli recognize) does not pay for it
+if TYPE_CHECKING:
+    from sklearn.base import BaseEstimator, ClassifierMixin, RegressorMixin
+
+def __getattr__(name:str):
+    # MiniBatchKMeansClassifier is a sklearn estimator, kept in its own module
+    if name == 'MiniBatchKMeansClassifier':
+        from kmeans_classifier import MiniBatchKMeansClassifier
+        return MiniBatchKMeansClassifier
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class MachineLearningMethod:
+    # optional ModelCache of fitted models and predictions (set by Experiment)
+    cache = None
+    # Tracer that records the time of each step (set by Experiment)
+    tracer = NULL_TRACER
+    # attributes not written by save (shared resources, not part of the model)
+    unsaved_attributes = ('cache', 'tracer')
 
     @abstractmethod
     def eval(self,df_practice:pd.DataFrame, df_data_to_predict:pd.DataFrame, col_category:str) -> Result:
         raise NotImplementedError
 
+    def eval_fold(self, fold:Fold) -> Result:
+        # methods that work over arrays override it to skip the DataFrame views
+        return self.eval(fold.df_practice, fold.df_data_to_predict, fold.col_category)
+
+    @abstractmethod
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        """
+        Categories of the rows of x, using the model fitted by the last eval
+        """
+        raise NotImplementedError
+
+    def load_cached_model(self) -> None:
+        """
+        Load the fitted model when eval_fold only kept its key in the cache, so the method
+        stays usable (predict, save) after the cache entry is removed
+        """
+        pass
+
+    def save(self, file_name:str) -> None:
+        method = copy.copy(self)
+        # removed from the copy, so the loaded method uses the class defaults
+        for attribute in self.unsaved_attributes:
+            method.__dict__.pop(attribute, None)
+        import joblib
+        joblib.dump(method, file_name)
+
+    @staticmethod
+    def load(file_name:str) -> "MachineLearningMethod":
+        import joblib
+        return joblib.load(file_name)
+
+class RandomForestTreePool():
+    # parameters that do not change the trees of a forest
+    IGNORED_PARAMS = ('n_estimators', 'warm_start', 'n_jobs', 'verbose')
+
+    def __init__(self, max_forests:int=64):
+        """
+        Fitted forests (warm_start) per (fold, parameters other than n_estimators).
+        A forest with more trees only fits the extra trees and one with less trees uses the
+        first ones, the same trees a new forest with the same random_state would have.
+
+        max_forests: number of forests kept (least recently used are discarded)
+        """
+        self.max_forests = max_forests
+        self.num_trees_fitted = 0
+        self.num_trees_reused = 0
+        self._forests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # copies of a method keep using the same pool
+        return self
+
+    def fit(self, estimator:Union["ClassifierMixin","RegressorMixin"], fold:Fold) -> Union["ClassifierMixin","RegressorMixin"]:
+        """
+        Return estimator fitted over fold's practice data, reusing trees already fitted
+        """
+        num_trees = estimator.get_params()['n_estimators']
+        params = sorted((name, repr(value)) for name, value in estimator.get_params().items() if name not in self.IGNORED_PARAMS)
+        key = (fold.fingerprint(), type(estimator), str(params))
+
+        with self._lock:
+            forest = self._forests.get(key)
+            if forest is not None:
+                self._forests.move_to_end(key)
+
+        if forest is None:
+            from sklearn.base import clone
+            forest = clone(estimator).set_params(warm_start=True)
+            forest.fit(fold.x_practice, fold.y_practice)
+            num_new_trees = num_trees
+        elif len(forest.estimators_) < num_trees:
+            # only the extra trees are fitted
+            num_new_trees = num_trees - len(forest.estimators_)
+            forest.set_params(n_estimators=num_trees)
+            forest.fit(fold.x_practice, fold.y_practice)
+        else:
+            num_new_trees = 0
+
+        with self._lock:
+            self.num_trees_fitted += num_new_trees
+            self.num_trees_reused += num_trees - num_new_trees
+            self._forests[key] = forest
+            while len(self._forests) > self.max_forests:
+                self._forests.popitem(last=False)
+
+        # forest with only the first num_trees trees (the stored one keeps growing)
+        model = copy.copy(forest)
+        model.estimators_ = forest.estimators_[:num_trees]
+        model.n_estimators = num_trees
+        return model
+
 class ScikitLearnMachineLearning(MachineLearningMethod):
     # ml_method is a ClassifierMixin or RegressorMixin
     # both are superclasses
-    def __init__(self,ml_method:Union[ClassifierMixin,RegressorMixin]):
+    unsaved_attributes = ('cache', 'tracer', 'tree_pool')
+    tree_pool = None
+
+    def __init__(self,ml_method:Union["ClassifierMixin","RegressorMixin"], cache=None, tree_pool:RandomForestTreePool=None):
         self.ml_method = ml_method
+        self.cache = cache
+        # forests only: reuse trees fitted by other methods on the same fold
+        self.tree_pool = tree_pool
+        # model fitted by the last eval (or the cache key to load it)
+        self.model = None
+        self._model_key = None
+
+    def fit(self, x:np.ndarray, y:np.ndarray) -> "ScikitLearnMachineLearning":
+        self.model = self.ml_method.fit(x, y)
+        self._model_key = None
+        return self
+
+    def load_cached_model(self) -> None:
+        # after a cache hit only the key is kept, a later put may evict the entry
+        if self.model is None and self._model_key is not None:
+            self.model = self.cache.load_model(self._model_key)
+            self._model_key = None
+
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        self.load_cached_model()
+        if self.model is None:
+            raise ValueError("The method has no fitted model, call fit or eval first")
+        return self.model.predict(x)
+
+    def save(self, file_name:str) -> None:
+        self.load_cached_model()
+        super().save(file_name)
 
     def eval(self, df_practice:pd.DataFrame, df_data_to_predict:pd.DataFrame, col_category:str, seed:int=1) -> Result:
         # from df_practice, split features from category
@@ -25,6 +180,7 @@ class ScikitLearnMachineLearning(MachineLearningMethod):
 
         # execute the fit method of ml_method e create the model
         model = self.ml_method.fit(x_practice,y_practice)
+        self.model, self._model_key = model, None
         # split to predict data in x and y groups
         x_to_predict = df_data_to_predict.drop(col_category,axis=1)
         y_to_predict = df_data_to_predict[col_category]
@@ -32,3 +188,208 @@ class ScikitLearnMachineLearning(MachineLearningMethod):
         # return results
         y_predictions = model.predict(x_to_predict)
         return Result(y_to_predict,y_predictions)
+
+    def eval_fold(self, fold:Fold) -> Result:
+        # skip the fit when this estimator was already evaluated on this fold
+        if self.cache is not None:
+            with self.tracer.span('cache'):
+                key = self.cache.key(self.ml_method, fold)
+                y_predictions = self.cache.get_predictions(key)
+            if y_predictions is not None:
+                # the model is only loaded if predict is called
+                self.model, self._model_key = None, key
+                return Result(fold.y_to_predict, y_predictions)
+
+        # features and category come straight from the fold's shared arrays
+        if self.tree_pool is not None:
+            with self.tracer.span('fit'):
+                model = self.tree_pool.fit(self.ml_method, fold)
+        else:
+            with self.tracer.span('prepare'):
+                x_practice, y_practice = fold.x_practice, fold.y_practice
+            with self.tracer.span('fit'):
+                model = self.ml_method.fit(x_practice, y_practice)
+        self.model, self._model_key = model, None
+
+        # return results
+        with self.tracer.span('prepare'):
+            x_to_predict, y_to_predict = fold.x_to_predict, fold.y_to_predict
+        with self.tracer.span('predict'):
+            y_predictions = model.predict(x_to_predict)
+        if self.cache is not None:
+            with self.tracer.span('cache'):
+                self.cache.put(key, model, y_predictions)
+        return Result(y_to_predict, y_predictions)
+
+# number of bits set in each byte value, used when np.bitwise_count is not available (numpy < 2.0)
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1).sum(axis=1).astype(np.uint8)
+
+def _popcount(words:np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape+(-1,)).sum(axis=-1)
+
+class HammingKNNMachineLearning(MachineLearningMethod):
+    def __init__(self, k:int=1, max_block_bytes:int=2**25):
+        """
+        k nearest neighbors over binary images packed in bits (784 pixels -> 98 bytes),
+        the distance (Hamming) is the popcount of the XOR of two images.
+        Pixels different from 0 are 1 (as create_binary_base).
+
+        k: number of neighbors, ties between categories go to the smallest category
+        max_block_bytes: memory of the distance block (queries x practice images) computed at once
+        """
+        self.k = k
+        self.max_block_bytes = max_block_bytes
+        self._words = None
+        self._label_codes = None
+        self.labels = None
+
+    @staticmethod
+    def pack(x:np.ndarray) -> np.ndarray:
+        # bits of each image, padded to 64-bit words
+        packed = pack_binary_images(np.asarray(x))
+        return HammingKNNMachineLearning._to_words(packed)
+
+    @staticmethod
+    def _to_words(packed:np.ndarray) -> np.ndarray:
+        num_bytes = packed.shape[1]
+        padded = np.zeros((len(packed), -(-num_bytes//8)*8), dtype=np.uint8)
+        padded[:, :num_bytes] = packed
+        return padded.view(np.uint64)
+
+    def fit(self, x:np.ndarray, y:np.ndarray) -> "HammingKNNMachineLearning":
+        return self.fit_packed(pack_binary_images(np.asarray(x)), y)
+
+    def fit_packed(self, packed:np.ndarray, y:np.ndarray) -> "HammingKNNMachineLearning":
+        """
+        Fit with images already packed by np.packbits (e.g. DatasetStore.raw_pixels of a _binary store)
+        """
+        self._words = self._to_words(np.asarray(packed))
+        self.labels, self._label_codes = np.unique(np.asarray(y), return_inverse=True)
+        return self
+
+    def distances(self, words:np.ndarray) -> np.ndarray:
+        """
+        Hamming distance between each packed query and each practice image
+        """
+        dist = np.zeros((len(words), len(self._words)), dtype=np.uint16)
+        # one 64-bit word at a time keeps the temporary arrays at (queries x practice images)
+        for num_word in range(words.shape[1]):
+            dist += _popcount(words[:, num_word, np.newaxis] ^ self._words[np.newaxis, :, num_word]).astype(np.uint16)
+        return dist
+
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        return self.predict_packed(pack_binary_images(np.asarray(x)))
+
+    def predict_packed(self, packed:np.ndarray) -> np.ndarray:
+        if self._words is None:
+            raise ValueError("The method has no fitted model, call fit or eval first")
+        words = self._to_words(np.asarray(packed))
+        num_practice = len(self._words)
+        num_categories = len(self.labels)
+        k = min(self.k, num_practice)
+        block_size = max(1, self.max_block_bytes//(num_practice*8))
+
+        predictions = np.empty(len(words), dtype=np.int64)
+        for ini in range(0, len(words), block_size):
+            dist = self.distances(words[ini:ini+block_size])
+            # ties between distances go to the first practice image
+            keys = dist.astype(np.int64)*num_practice + np.arange(num_practice)
+            neighbors = np.argpartition(keys, k-1, axis=1)[:, :k]
+
+            # votes per category of each query
+            codes = self._label_codes[neighbors] + num_categories*np.arange(len(neighbors))[:, np.newaxis]
+            votes = np.bincount(codes.ravel(), minlength=len(neighbors)*num_categories).reshape(-1, num_categories)
+            predictions[ini:ini+block_size] = votes.argmax(axis=1)
+
+        return self.labels[predictions]
+
+    def eval(self, df_practice:pd.DataFrame, df_data_to_predict:pd.DataFrame, col_category:str) -> Result:
+        self.fit(df_practice.drop(col_category, axis=1).to_numpy(), df_practice[col_category].to_numpy())
+        return Result(df_data_to_predict[col_category], self.predict(df_data_to_predict.drop(col_category, axis=1).to_numpy()))
+
+    def eval_fold(self, fold:Fold) -> Result:
+        with self.tracer.span('fit'):
+            self.fit(fold.x_practice, fold.y_practice)
+        with self.tracer.span('predict'):
+            y_predictions = self.predict(fold.x_to_predict)
+        return Result(fold.y_to_predict, y_predictions)
+
+class StreamingMachineLearning(MachineLearningMethod):
+    def __init__(self, estimator:"BaseEstimator", classes:np.ndarray, num_epochs:int=1,
+                scale:float=255.0, chunk_size:int=4096):
+        """
+        Estimator trained chunk by chunk with partial_fit, for data that does not fit in memory
+        (see streaming.StreamingFold). Only one chunk is in memory at a time.
+
+        estimator: scikit-learn estimator with partial_fit (e.g. SGDClassifier, MultinomialNB,
+                    BernoulliNB or MiniBatchKMeansClassifier), it is cloned before fitting
+        classes: every category, partial_fit needs them on the first chunk
+        num_epochs: passes over the practice chunks
+        scale: pixels are divided by scale (as float32), None keeps them as they are
+        chunk_size: rows per chunk when the data is in memory (eval and eval_fold)
+        """
+        self.estimator = estimator
+        self.classes = np.asarray(classes)
+        self.num_epochs = num_epochs
+        self.scale = scale
+        self.chunk_size = chunk_size
+        self.model = None
+
+    def features(self, x:np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        return x/self.scale if self.scale is not None else x
+
+    def partial_fit(self, x:np.ndarray, y:np.ndarray) -> "StreamingMachineLearning":
+        if self.model is None:
+            from sklearn.base import clone
+            self.model = clone(self.estimator)
+        self.model.partial_fit(self.features(x), np.asarray(y), classes=self.classes)
+        return self
+
+    def fit_chunks(self, chunks:Callable[[], Iterable[Tuple[np.ndarray, np.ndarray]]]) -> "StreamingMachineLearning":
+        """
+        chunks: function returning a new iterator of (x, y) chunks, called once per epoch
+        """
+        self.model = None
+        for _ in range(self.num_epochs):
+            for x, y in chunks():
+                self.partial_fit(x, y)
+        return self
+
+    def predict(self, x:np.ndarray) -> np.ndarray:
+        if self.model is None:
+            raise ValueError("The method has no fitted model, call fit_chunks or eval first")
+        return np.concatenate([self.model.predict(self.features(x[ini:ini+self.chunk_size]))
+                                for ini in range(0, len(x), self.chunk_size)] or [np.zeros(0, dtype=self.classes.dtype)])
+
+    def eval_chunks(self, practice_chunks:Callable[[], Iterable[Tuple[np.ndarray, np.ndarray]]],
+                    predict_chunks:Iterable[Tuple[np.ndarray, np.ndarray]]) -> Result:
+        """
+        Fit with practice_chunks and count the predictions of predict_chunks, chunk by chunk
+        """
+        with self.tracer.span('fit'):
+            self.fit_chunks(practice_chunks)
+        result = Result([], [])
+        with self.tracer.span('predict'):
+            for x, y in predict_chunks:
+                result.update(y, self.model.predict(self.features(x)))
+        return result
+
+    def _array_chunks(self, x:np.ndarray, y:np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for ini in range(0, len(y), self.chunk_size):
+            yield x[ini:ini+self.chunk_size], y[ini:ini+self.chunk_size]
+
+    def eval(self, df_practice:pd.DataFrame, df_data_to_predict:pd.DataFrame, col_category:str) -> Result:
+        x_practice, y_practice = df_practice.drop(col_category, axis=1).to_numpy(), df_practice[col_category].to_numpy()
+        return self.eval_chunks(lambda: self._array_chunks(x_practice, y_practice),
+                                self._array_chunks(df_data_to_predict.drop(col_category, axis=1).to_numpy(),
+                                                    df_data_to_predict[col_category].to_numpy()))
+
+    def eval_fold(self, fold) -> Result:
+        # streaming.StreamingFold reads its chunks from disk, Fold slices its shared arrays
+        if hasattr(fold, 'practice_chunks'):
+            return self.eval_chunks(fold.practice_chunks, fold.predict_chunks())
+        return self.eval_chunks(lambda: self._array_chunks(fold.x_practice, fold.y_practice),
+                                self._array_chunks(fold.x_to_predict, fold.y_to_predict))
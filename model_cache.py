@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from typing import Optional
+
+from results import Fold
+
+class ModelCache():
+    def __init__(self, cache_dir:str, max_bytes:int=2**30):
+        """
+        On-disk cache of fitted models and their predictions, shared by all methods of an Experiment.
+        An entry is identified by the estimator (class and get_params()) and the fold (data and row indices).
+        When the cache grows beyond max_bytes the least recently used entries are removed.
+
+        cache_dir: directory where entries are stored
+        max_bytes: size limit of the directory
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_counts(self, hits:int, misses:int) -> None:
+        # merge the hits and misses counted by a copy of the cache in another process
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def __deepcopy__(self, memo):
+        # copies of a method keep using the same cache
+        return self
+
+    @staticmethod
+    def fold_fingerprint(fold:Fold) -> str:
+        return fold.fingerprint()
+
+    def key(self, estimator, fold:Fold) -> str:
+        import sklearn
+        params = sorted((name, repr(value)) for name, value in estimator.get_params(deep=True).items())
+        description = f"{type(estimator).__module__}.{type(estimator).__qualname__}|{sklearn.__version__}|{params}|{self.fold_fingerprint(fold)}"
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def _path(self, key:str, extension:str) -> str:
+        return os.path.join(self.cache_dir, key+extension)
+
+    def get_predictions(self, key:str) -> Optional[np.ndarray]:
+        """
+        Stored predictions of an entry (None when it is not cached)
+        """
+        path = self._path(key, '.npy')
+        try:
+            predictions = np.load(path, allow_pickle=True)
+            # last access time for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, EOFError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return predictions
+
+    def load_model(self, key:str):
+        import joblib
+        return joblib.load(self._path(key, '.joblib'))
+
+    def put(self, key:str, model, predictions:np.ndarray) -> None:
+        # write to temporary files and rename, so readers (or other processes) never see partial entries
+        import joblib
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        joblib.dump(model, self._path(key, '.joblib')+suffix)
+        with open(self._path(key, '.npy')+suffix, 'wb') as file:
+            np.save(file, np.asarray(predictions), allow_pickle=True)
+        os.replace(self._path(key, '.joblib')+suffix, self._path(key, '.joblib'))
+        os.replace(self._path(key, '.npy')+suffix, self._path(key, '.npy'))
+        self.evict()
+
+    def _entries(self) -> list:
+        # (last access, size, key) of every entry
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.npy'):
+                continue
+            key = file_name[:-len('.npy')]
+            try:
+                stat = os.stat(self._path(key, '.npy'))
+                size = stat.st_size + os.path.getsize(self._path(key, '.joblib'))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, size, key))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Remove least recently used entries until the cache fits in max_bytes
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for extension in ('.npy', '.joblib'):
+                try:
+                    os.remove(self._path(key, extension))
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    @property
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'size_bytes': sum(size for _, size, _ in entries)}
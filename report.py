@@ -0,0 +1,151 @@
+import base64
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from typing import List
+
+from results import Result
+
+# figure of each worker process, reused (cleared) for every fold it renders
+_figure = None
+
+def _get_figure():
+    global _figure
+    if _figure is None:
+        import matplotlib
+        # no display needed (CI and batch nodes)
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        _figure, _ = plt.subplots(2, 2, figsize=(14, 12))
+    for ax in _figure.axes:
+        ax.clear()
+    return _figure
+
+def _plot_metric(ax, labels:list, values:list, metric_name:str, color:str) -> None:
+    # same chart as work_methods.plot_metric
+    positions = np.arange(len(labels))
+    ax.bar(positions, values, color=color)
+    for position, value in zip(positions, values):
+        ax.text(position, value, round(value, 3), ha='center', va='bottom', fontsize=8)
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels)
+    ax.set_ylim(0, 1.1)
+    ax.set_xlabel('Categoria')
+    ax.set_ylabel(metric_name)
+    ax.set_title(f'{metric_name} por Categoria')
+
+def _plot_confusion_matrix(ax, labels:list, confusion_matrix:np.ndarray) -> None:
+    # as show_results: real categories on the x axis, predicted ones on the y axis
+    matrix = confusion_matrix.T
+    ax.imshow(matrix, cmap='Blues')
+    threshold = matrix.max()/2 if matrix.size else 0
+    for row, column in np.ndindex(matrix.shape):
+        ax.text(column, row, matrix[row, column], ha='center', va='center', fontsize=8,
+                color='white' if matrix[row, column] > threshold else 'black')
+    positions = np.arange(len(labels))
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels)
+    ax.set_yticks(positions)
+    ax.set_yticklabels(labels)
+    ax.set_title('Matriz de Confusão')
+    ax.set_xlabel('Valor Real')
+    ax.set_ylabel('Valor Previsto')
+
+def render_fold(metrics:dict, file_name:str, dpi:int=80) -> str:
+    """
+    PNG with the f1, precision and recall per category and the confusion matrix of a fold
+
+    metrics: Result.to_dict of the fold
+    """
+    figure = _get_figure()
+    ax_f1, ax_precision, ax_recall, ax_confusion = figure.axes
+    labels = metrics['labels']
+    _plot_metric(ax_f1, labels, metrics['f1'], 'F1 per category', 'blue')
+    _plot_metric(ax_precision, labels, metrics['precision'], 'Precision', 'green')
+    _plot_metric(ax_recall, labels, metrics['recall'], 'Recall', 'orange')
+    _plot_confusion_matrix(ax_confusion, labels, np.asarray(metrics['confusion_matrix']))
+    figure.suptitle(f"Macro f1: {metrics['macro_f1']:.4f}  Accuracy: {metrics['accuracy']:.4f}")
+    figure.savefig(file_name, dpi=dpi)
+    return file_name
+
+def render_summary(arr_metrics:List[dict], file_name:str, dpi:int=80) -> str:
+    """
+    PNG with the macro f1 and accuracy of every fold
+    """
+    figure = _get_figure()
+    ax_f1, ax_accuracy = figure.axes[:2]
+    for ax in figure.axes[2:]:
+        ax.set_axis_off()
+    fold_labels = list(range(len(arr_metrics)))
+    _plot_metric(ax_f1, fold_labels, [metrics['macro_f1'] for metrics in arr_metrics], 'Macro f1', 'blue')
+    _plot_metric(ax_accuracy, fold_labels, [metrics['accuracy'] for metrics in arr_metrics], 'Accuracy', 'green')
+    for ax in (ax_f1, ax_accuracy):
+        ax.set_xlabel('Fold')
+        ax.set_title(ax.get_ylabel()+' por Fold')
+    figure.suptitle('')
+    figure.savefig(file_name, dpi=dpi)
+    for ax in figure.axes[2:]:
+        ax.set_axis_on()
+    return file_name
+
+def _render(task:tuple) -> str:
+    function, args = task
+    return function(*args)
+
+def _image_tag(file_name:str) -> str:
+    # images are embedded, so index.html can be moved alone
+    with open(file_name, 'rb') as file:
+        data = base64.b64encode(file.read()).decode()
+    return f'<img src="data:image/png;base64,{data}" alt="{html.escape(os.path.basename(file_name))}">'
+
+def generate_report(results:List[Result], directory:str, name:str='Experiment', arr_fold_info:List[dict]=None,
+                    n_jobs:int=None, dpi:int=80) -> str:
+    """
+    Write, in directory, the figures of every fold (fold_i.png), the summary (summary.png), the metrics
+    of every fold (metrics.json) and index.html with all of them. Returns the name of index.html.
+
+    results: Result of each fold (e.g. Experiment.results)
+    arr_fold_info: extra information shown for each fold (e.g. the best parameters)
+    n_jobs: processes rendering the figures (default: one per cpu)
+    """
+    os.makedirs(directory, exist_ok=True)
+    arr_metrics = [result.to_dict() for result in results]
+    arr_fold_info = arr_fold_info if arr_fold_info is not None else [{} for _ in results]
+    summary = {'name': name, 'macro_f1_avg': float(np.mean([metrics['macro_f1'] for metrics in arr_metrics])) if arr_metrics else None,
+                'accuracy_avg': float(np.mean([metrics['accuracy'] for metrics in arr_metrics])) if arr_metrics else None,
+                'folds': [{**info, **metrics} for info, metrics in zip(arr_fold_info, arr_metrics)]}
+    with open(os.path.join(directory, 'metrics.json'), 'w') as file:
+        json.dump(summary, file, indent=2)
+
+    tasks = [(render_summary, (arr_metrics, os.path.join(directory, 'summary.png'), dpi))]
+    tasks += [(render_fold, (metrics, os.path.join(directory, f"fold_{num_fold}.png"), dpi))
+                for num_fold, metrics in enumerate(arr_metrics)]
+    n_jobs = min(n_jobs if n_jobs is not None else (os.cpu_count() or 1), len(tasks))
+    if n_jobs <= 1:
+        arr_file_names = [_render(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            arr_file_names = list(executor.map(_render, tasks))
+
+    sections = [f"<h1>{html.escape(name)}</h1>",
+                f"<p>Average macro f1: {summary['macro_f1_avg']:.4f}, average accuracy: {summary['accuracy_avg']:.4f}</p>" if arr_metrics else "",
+                _image_tag(arr_file_names[0])]
+    for num_fold, (info, metrics, file_name) in enumerate(zip(arr_fold_info, arr_metrics, arr_file_names[1:])):
+        details = ''.join(f"<li>{html.escape(str(key))}: {html.escape(str(value))}</li>" for key, value in info.items())
+        sections.append(f"<h2>Fold {num_fold}</h2><p>Macro f1: {metrics['macro_f1']:.4f}, accuracy: {metrics['accuracy']:.4f}</p>"
+                        f"<ul>{details}</ul>{_image_tag(file_name)}")
+
+    file_name = os.path.join(directory, 'index.html')
+    with open(file_name, 'w') as file:
+        file.write(f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(name)}</title></head>"
+                    f"<body>{''.join(sections)}</body></html>\n")
+    return file_name
+
+def report_experiment(exp, directory:str, name:str='Experiment', n_jobs:int=None) -> str:
+    """
+    generate_report of an Experiment, with the best parameters of each fold
+    """
+    arr_fold_info = [{'best_params': study.best_trial.params} for study in exp.studies_per_fold] or None
+    return generate_report(exp.results, directory, name, arr_fold_info, n_jobs)
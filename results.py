@@ -1,8 +1,8 @@
-from sklearn.exceptions import UndefinedMetricWarning
-import optuna
+import hashlib
 import numpy as np
 import pandas as pd
 import warnings
+import mmap
 from typing import List
 
 class Result():
@@ -15,121 +15,361 @@ class Result():
         """
         self.y = y
         self.predict_y = predict_y
+        self._labels = None
+        self._confusion_matrix_array = None
         self._confusion_matrix = None
+        self._precision_array = None
+        self._recall_array = None
+        self._f1_array = None
         self._precision = None
         self._recall = None
+        self._f1_per_category = None
 
     @property
-    def confusion_matrix(self) -> np.ndarray:
+    def labels(self) -> np.ndarray:
         """
-        Return confusion matrix
+        Sorted categories found in y or predict_y, index i of the arrays refers to labels[i]
         """
-        # just return if it already exists
-        if self._confusion_matrix  is not None:
-            return self._confusion_matrix
+        if self._labels is None:
+            self._labels = np.union1d(np.asarray(self.y), np.asarray(self.predict_y))
+        return self._labels
 
-        # get all categorys values
-        set_class = set(self.y)|set(self.predict_y)
-        # let's start confusion matrix as a zero matrix
-        # confusion matrix will have a maximum size based on values of self.y and self.predict_y
-        self._confusion_matrix = {}
-        for real_category in set_class:
-            self._confusion_matrix[real_category] = {}
-            for class_predita in set_class:
-                self._confusion_matrix[real_category][class_predita] = 0
+    @property
+    def confusion_matrix_array(self) -> np.ndarray:
+        """
+        Dense confusion matrix: rows are the real categories and columns the predicted ones (both ordered as labels)
+        """
+        if self._confusion_matrix_array is not None:
+            return self._confusion_matrix_array
+
+        num_labels = len(self.labels)
+        # position of each value in labels
+        real_index = np.searchsorted(self.labels, np.asarray(self.y))
+        predicted_index = np.searchsorted(self.labels, np.asarray(self.predict_y))
 
-        # the values of the matrix should be incresed based on self.y and self.predict_y lists
-        for i,real_category in enumerate(self.y):
-            self._confusion_matrix[real_category][self.predict_y[i]] += 1
+        # count every (real, predicted) pair at once
+        counts = np.bincount(real_index*num_labels + predicted_index, minlength=num_labels*num_labels)
+        self._confusion_matrix_array = counts.reshape(num_labels, num_labels)
+        return self._confusion_matrix_array
 
+    @property
+    def confusion_matrix(self) -> dict:
+        """
+        Return confusion matrix as confusion_matrix[real_category][predicted_category]
+        """
+        # just return if it already exists
+        if self._confusion_matrix is not None:
+            return self._confusion_matrix
+
+        labels = self.labels.tolist()
+        self._confusion_matrix = {real_category: dict(zip(labels, row)) for real_category, row in zip(labels, self.confusion_matrix_array.tolist())}
         return self._confusion_matrix
 
+    def _per_category(self, values:np.ndarray) -> dict:
+        return dict(zip(self.labels.tolist(), values.tolist()))
+
     @property
-    def precision(self):
+    def precision_array(self) -> np.ndarray:
         """
-        precision per class
+        precision per class (ordered as labels)
         """
-        if self._precision is not None:
-            return self._precision
+        if self._precision_array is not None:
+            return self._precision_array
 
-        self._precision = {}
+        # precision: number of elements predicted correctly / all predicted with this category
+        num_predicted_category = self.confusion_matrix_array.sum(axis=0)
+        num_correct = np.diagonal(self.confusion_matrix_array)
+        self._precision_array = np.divide(num_correct, num_predicted_category, out=np.zeros(len(self.labels)), where=num_predicted_category!=0)
 
-        # for each class, it will store the relative value of precision en self._precision[class]
-        for category in self.confusion_matrix.keys():
-            # get all elements which have been predicted for this class
-            num_predicted_category = 0
-            for real_category in self.confusion_matrix.keys():
-                num_predicted_category += self.confusion_matrix[real_category][category]
+        for category in self.labels[num_predicted_category==0]:
+            _undefined_metric_warning("There is no predicted elements for this category "+str(category)+" precisio set as zero.")
+        return self._precision_array
 
-            # precision: number of elements predicted correctly / all predicted with this category
-            # calculate precision for this category
-            if num_predicted_category!=0:
-                self._precision[category] =  self.confusion_matrix[category][category]/num_predicted_category
-            else:
-                self._precision[category] = 0
-                warnings.warn("There is no predicted elements for this category "+str(category)+" precisio set as zero.", UndefinedMetricWarning)
-        return self._precision
+    @property
+    def recall_array(self) -> np.ndarray:
+        """
+        recall per class (ordered as labels)
+        """
+        if self._recall_array is not None:
+            return self._recall_array
+
+        # recall: number of correctly predicted elements / total o elements from this category
+        num_elements_category = self.confusion_matrix_array.sum(axis=1)
+        num_correct = np.diagonal(self.confusion_matrix_array)
+        self._recall_array = np.divide(num_correct, num_elements_category, out=np.zeros(len(self.labels)), where=num_elements_category!=0)
+
+        for category in self.labels[num_elements_category==0]:
+            _undefined_metric_warning("There is no elemenst for this category "+str(category)+" recall set as zero.")
+        return self._recall_array
 
     @property
-    def recall(self):
-        if self._recall is not None:
-            return self._recall
+    def f1_array(self) -> np.ndarray:
+        """
+        f1 per class (ordered as labels)
+        """
+        if self._f1_array is not None:
+            return self._f1_array
 
-        self._recall = {}
-        for category in self.confusion_matrix.keys():
-            # pass through matrix, get all elements for this category
-            num_category = 0
-            num_elements_category = 0
-            for predicted_category in self.confusion_matrix.keys():
-                num_elements_category += self.confusion_matrix[category][predicted_category]
+        precision_recall = self.precision_array + self.recall_array
+        self._f1_array = np.divide(2*self.precision_array*self.recall_array, precision_recall, out=np.zeros(len(self.labels)), where=precision_recall!=0)
+        return self._f1_array
 
-            # recall: number of correctly predicted elements / total o elements from this category
-            if num_elements_category!=0:
-                self._recall[category] =  self.confusion_matrix[category][category]/num_elements_category
-            else:
-                self._recall[category] = 0
-                warnings.warn("There is no elemenst for this category "+str(category)+" recall set as zero.", UndefinedMetricWarning)
+    @property
+    def precision(self) -> dict:
+        """
+        precision per class
+        """
+        if self._precision is None:
+            self._precision = self._per_category(self.precision_array)
+        return self._precision
+
+    @property
+    def recall(self) -> dict:
+        if self._recall is None:
+            self._recall = self._per_category(self.recall_array)
         return self._recall
 
     @property
-    def f1_per_category(self):
+    def f1_per_category(self) -> dict:
         """
         returns a vector for each category's f1
         """
-        f1 = {}
-        for category in self.confusion_matrix.keys():
-            if(self.precision[category]+self.recall[category] == 0):
-                f1[category] = 0
-            else:
-                f1[category] = 2*(self.precision[category]*self.recall[category])/(self.precision[category]+self.recall[category])
-        return f1
+        if self._f1_per_category is None:
+            self._f1_per_category = self._per_category(self.f1_array)
+        return self._f1_per_category
 
     @property
-    def macro_f1(self):
+    def macro_f1(self) -> float:
         # f1 per category over calculated feature.
-        return np.average(list(self.f1_per_category.values()))
+        return float(np.average(self.f1_array))
 
     @property
-    def accuracy(self):
+    def accuracy(self) -> float:
         # number of correctly predicted elements
-        num_previstos_corretamente = 0
-        for category in range(len(self.confusion_matrix)):
-            num_previstos_corretamente  += self.confusion_matrix[category][category]
+        num_previstos_corretamente = np.trace(self.confusion_matrix_array)
+
+        return num_previstos_corretamente/self.confusion_matrix_array.sum()
+
+    def to_dict(self) -> dict:
+        """
+        Metrics as plain lists and numbers (json serializable), per category values are ordered as labels
+        """
+        return {'labels': self.labels.tolist(), 'confusion_matrix': self.confusion_matrix_array.tolist(),
+                'precision': self.precision_array.tolist(), 'recall': self.recall_array.tolist(),
+                'f1': self.f1_array.tolist(), 'macro_f1': self.macro_f1, 'accuracy': float(self.accuracy),
+                'num_rows': int(self.confusion_matrix_array.sum())}
+
+    @staticmethod
+    def from_confusion_matrix(labels:np.ndarray, confusion_matrix_array:np.ndarray) -> "Result":
+        """
+        Result of an already counted confusion matrix (rows real, columns predicted, both ordered as labels)
+        """
+        result = Result(None, None)
+        result._labels = np.asarray(labels)
+        result._confusion_matrix_array = np.asarray(confusion_matrix_array)
+        return result
+
+    def update(self, y:List[float], predict_y:List[float]) -> "Result":
+        """
+        Add the predictions of another chunk of rows. Only the confusion matrix is kept (y and
+        predict_y become None), so the memory does not grow with the number of rows.
+        """
+        chunk = Result(y, predict_y)
+        if len(self.labels) == 0:
+            # nothing counted yet (e.g. Result([], [])): take the chunk as is
+            labels, matrix = chunk.labels, chunk.confusion_matrix_array.copy()
+        else:
+            labels = np.union1d(self.labels, chunk.labels)
+            matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+            for result in (self, chunk):
+                positions = np.searchsorted(labels, result.labels)
+                matrix[np.ix_(positions, positions)] += result.confusion_matrix_array
+
+        self.__init__(None, None)
+        self._labels = labels
+        self._confusion_matrix_array = matrix
+        return self
+
+def _undefined_metric_warning(message:str) -> None:
+    # sklearn is only imported when there is something to warn (it takes more than a second to import)
+    from sklearn.exceptions import UndefinedMetricWarning
+    warnings.warn(message, UndefinedMetricWarning)
+
+def _open_memmap(filename:str, dtype, shape:tuple, offset:int) -> np.memmap:
+    return np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset)
+
+def _is_file_mapping(arr) -> bool:
+    # a whole read-only memory-mapped file (not a view of one)
+    return isinstance(arr, np.memmap) and isinstance(arr.base, mmap.mmap) and arr.filename is not None and not arr.flags.writeable
+
+class FoldData():
+    def __init__(self, x:np.ndarray, y:np.ndarray, columns:List[str], col_category:str,
+                index:np.ndarray=None, category_position:int=None):
+        """
+        Feature matrix and category vector shared by all folds, folds only keep row indices over it.
+
+        x: feature matrix (one row per instance)
+        y: category of each row
+        columns: feature names, one per column of x
+        col_category: name of the category column
+        index: row labels used by the DataFrame views (default 0..n-1)
+        category_position: position of the category column in the DataFrame views (default last)
+        """
+        self.x = x
+        self.y = y
+        self.columns = list(columns)
+        self.col_category = col_category
+        self.index = index if index is not None else np.arange(len(y))
+        self.category_position = category_position if category_position is not None else len(self.columns)
+
+    @staticmethod
+    def from_dataframe(df_data:pd.DataFrame, col_category:str) -> "FoldData":
+        columns = df_data.columns.drop(col_category)
+        return FoldData(df_data[columns].to_numpy(), df_data[col_category].to_numpy(), columns, col_category,
+                        df_data.index.to_numpy(), df_data.columns.get_loc(col_category))
+
+    def __len__(self):
+        return len(self.y)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of x and y (computed once, the data of a fold is not modified)
+        """
+        if getattr(self, '_fingerprint', None) is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for arr in (self.x, self.y):
+                arr = np.ascontiguousarray(arr)
+                digest.update(str((arr.dtype, arr.shape)).encode())
+                digest.update(arr.reshape(-1).view(np.uint8))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def __reduce__(self):
+        # memory-mapped arrays are reopened (not copied) when sent to another process
+        state = self.__dict__.copy()
+        for name in ('x', 'y'):
+            arr = state[name]
+            if _is_file_mapping(arr):
+                state[name] = (_open_memmap, (arr.filename, arr.dtype, arr.shape, arr.offset))
+            else:
+                state[name] = (np.asarray, (arr,))
+        return (_rebuild_fold_data, (state,))
+
+    def select_features(self, feature_indices:np.ndarray) -> "FoldData":
+        """
+        Same rows with only the given feature columns (e.g. from feature_selection.select_features)
+        """
+        feature_indices = np.asarray(feature_indices)
+        return FoldData(self.x[:, feature_indices], self.y, [self.columns[i] for i in feature_indices],
+                        self.col_category, self.index)
+
+    def dataframe(self, rows:np.ndarray) -> pd.DataFrame:
+        """
+        Build a DataFrame (features and category) with the given rows
+        """
+        df_data = pd.DataFrame(self.x[rows], columns=self.columns, index=self.index[rows])
+        df_data.insert(self.category_position, self.col_category, self.y[rows])
+        return df_data
 
-        return num_previstos_corretamente/len(self.y)
+def _rebuild_fold_data(state:dict) -> FoldData:
+    data = FoldData.__new__(FoldData)
+    for name in ('x', 'y'):
+        function, args = state[name]
+        state[name] = function(*args)
+    data.__dict__.update(state)
+    return data
 
 class Fold():
     def __init__(self,df_practice :pd.DataFrame,  df_data_to_predict:pd.DataFrame,
-                col_category:str,num_folds_validation:int=0,num_threshold_validation:int=0):
-        self.df_practice = df_practice
-        self.df_data_to_predict = df_data_to_predict
+                col_category:str,num_folds_validation:int=0,num_threshold_validation:int=0,
+                data:FoldData=None, practice_indices:np.ndarray=None, predict_indices:np.ndarray=None,
+                validation_splits:List[tuple]=None):
+        """
+        A fold can be created from two DataFrames (df_practice and df_data_to_predict) or,
+        without copying data, from row indices (practice_indices and predict_indices) over data.
+
+        validation_splits: (practice_indices, predict_indices) of each validation fold (e.g. from a
+                            split_plan.SplitPlan), instead of generating num_folds_validation folds
+        """
         self.col_category = col_category
+        self._df_practice = df_practice
+        self._df_data_to_predict = df_data_to_predict
 
-        # Start arr_folds_validation properly
-        if num_folds_validation>0:
-            self.arr_folds_validation = self.generate_k_folds(df_practice,num_folds_validation,col_category,num_threshold_validation)
-        else:
-            self.arr_folds_validation = []
+        if data is None:
+            data = FoldData.from_dataframe(pd.concat([df_practice, df_data_to_predict]), col_category)
+            practice_indices = np.arange(len(df_practice))
+            predict_indices = np.arange(len(df_practice), len(data))
+        self.data = data
+        self.practice_indices = practice_indices
+        self.predict_indices = predict_indices
+
+        # validation folds are only created when arr_folds_validation is first used
+        self.num_folds_validation = num_folds_validation
+        self.num_threshold_validation = num_threshold_validation
+        self.validation_splits = validation_splits
+        self._arr_folds_validation = None
+
+    @property
+    def arr_folds_validation(self) -> List["Fold"]:
+        if self._arr_folds_validation is None:
+            if self.validation_splits is not None:
+                self._arr_folds_validation = [Fold.from_indices(self.data, practice_indices, predict_indices)
+                                                for practice_indices, predict_indices in self.validation_splits]
+            elif self.num_folds_validation>0:
+                self._arr_folds_validation = self._generate_k_folds(self.data, self.practice_indices, self.num_folds_validation,
+                                                                    self.col_category, self.num_threshold_validation)
+            else:
+                self._arr_folds_validation = []
+        return self._arr_folds_validation
+
+    @arr_folds_validation.setter
+    def arr_folds_validation(self, arr_folds_validation:List["Fold"]):
+        self._arr_folds_validation = arr_folds_validation
+
+    @staticmethod
+    def from_indices(data:FoldData, practice_indices:np.ndarray, predict_indices:np.ndarray,
+                    num_folds_validation:int=0, num_threshold_validation:int=0, validation_splits:List[tuple]=None) -> "Fold":
+        return Fold(None, None, data.col_category, num_folds_validation, num_threshold_validation,
+                    data, practice_indices, predict_indices, validation_splits)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the fold's shared data and of its practice/predict rows
+        """
+        digest = hashlib.blake2b(self.data.fingerprint().encode(), digest_size=16)
+        for indices in (self.practice_indices, self.predict_indices):
+            indices = np.ascontiguousarray(indices, dtype=np.int64)
+            digest.update(str(len(indices)).encode())
+            digest.update(indices.view(np.uint8))
+        return digest.hexdigest()
+
+    @property
+    def df_practice(self) -> pd.DataFrame:
+        if self._df_practice is None:
+            self._df_practice = self.data.dataframe(self.practice_indices)
+        return self._df_practice
+
+    @property
+    def df_data_to_predict(self) -> pd.DataFrame:
+        if self._df_data_to_predict is None:
+            self._df_data_to_predict = self.data.dataframe(self.predict_indices)
+        return self._df_data_to_predict
+
+    @property
+    def x_practice(self) -> np.ndarray:
+        return self.data.x[self.practice_indices]
+
+    @property
+    def y_practice(self) -> np.ndarray:
+        return self.data.y[self.practice_indices]
+
+    @property
+    def x_to_predict(self) -> np.ndarray:
+        return self.data.x[self.predict_indices]
+
+    @property
+    def y_to_predict(self) -> np.ndarray:
+        return self.data.y[self.predict_indices]
 
     @staticmethod
     def generate_k_folds(df_data,val_k:int,col_category:str,num_threshold:int=1,seed:int=1,
@@ -137,20 +377,32 @@ class Fold():
         """
         Return a vector arr_folds with all created k folds based on DataFrame df_data
 
-        df_data: DataFrame with all data to be used
+        df_data: DataFrame (or FoldData) with all data to be used
         val_k: parameter k of cross validation for k-folds
         col_category: column that represents a category
         seed: seed for random sample
         """
-        
-        num_instances_per_partition = len(df_data.index)//val_k
+        if isinstance(df_data, FoldData):
+            data = df_data
+        else:
+            data = FoldData.from_dataframe(df_data, col_category)
+
+        return Fold._generate_k_folds(data, np.arange(len(data)), val_k, col_category, num_threshold, seed,
+                                        num_folds_validation, num_threshold_validation)
+
+    @staticmethod
+    def _generate_k_folds(data:FoldData, rows:np.ndarray, val_k:int, col_category:str, num_threshold:int=1, seed:int=1,
+                        num_folds_validation:int=0, num_threshold_validation:int=1) -> List["Fold"]:
+        """
+        Same as generate_k_folds, only using the given rows of data
+        """
+        num_instances_per_partition = len(rows)//val_k
         # output folds
         arr_folds = []
 
-
         for index in range(num_threshold):
-            # random sample
-            df_data_rand = df_data.sample(frac=1,random_state=seed+index)
+            # random sample (same order as DataFrame.sample(frac=1, random_state=seed+index))
+            rows_rand = rows[np.random.RandomState(seed+index).choice(len(rows), len(rows), replace=False)]
 
             # for each num_fold:
             for num_fold in range(val_k):
@@ -159,16 +411,15 @@ class Fold():
                 if num_fold < val_k-1:
                     fim_fold_to_predict = num_instances_per_partition+ini_fold_to_predict
                 else:
-                    fim_fold_to_predict = len(df_data)
-
-                # set a df to predict
-                df_to_predict = df_data_rand[ini_fold_to_predict:fim_fold_to_predict]
+                    fim_fold_to_predict = len(rows)
 
-                # set practice
-                df_practice = df_data_rand.drop(df_to_predict.index)
+                # set rows to predict and practice
+                predict_indices = rows_rand[ini_fold_to_predict:fim_fold_to_predict]
+                practice_indices = np.concatenate((rows_rand[:ini_fold_to_predict], rows_rand[fim_fold_to_predict:]))
 
                 # set fold and store it
-                fold = Fold(df_practice,df_to_predict,col_category,num_folds_validation,num_threshold_validation)
+                fold = Fold(None, None, col_category, num_folds_validation, num_threshold_validation,
+                            data, practice_indices, predict_indices)
                 arr_folds.append(fold)
 
         return arr_folds
@@ -0,0 +1,212 @@
+import time
+import numpy as np
+from scipy import ndimage
+from typing import Iterable, Iterator, List
+
+from file_pipeline import preprocess_pixels
+
+SQUARE_REFERENCE = 28
+# MNIST digits fit in a 20x20 box, centered by their center of mass in the 28x28 image
+GLYPH_BOX = 20
+
+def load_page(file_name:str) -> np.ndarray:
+    """
+    Grayscale (uint8) image of a scanned page
+    """
+    from PIL import Image
+    with Image.open(file_name) as image:
+        return np.asarray(image.convert('L'))
+
+def otsu_threshold(ink:np.ndarray) -> int:
+    """
+    Threshold (0..255) that best separates ink and background (Otsu), from the histogram of the page
+    """
+    histogram = np.bincount(ink.ravel(), minlength=256).astype(np.float64)
+    weight_background = np.cumsum(histogram)
+    weight_ink = weight_background[-1] - weight_background
+    sum_background = np.cumsum(histogram*np.arange(256))
+    mean_background = np.divide(sum_background, weight_background, out=np.zeros(256), where=weight_background > 0)
+    mean_ink = np.divide(sum_background[-1] - sum_background, weight_ink, out=np.zeros(256), where=weight_ink > 0)
+    between_variance = weight_background*weight_ink*(mean_background - mean_ink)**2
+    return int(between_variance.argmax())
+
+def ink_image(page:np.ndarray, dark_ink:bool=None) -> np.ndarray:
+    """
+    Page as ink intensity (0 background, 255 ink), as the MNIST images
+
+    dark_ink: ink darker than the paper (default: guessed, most of a page is paper)
+    """
+    page = np.asarray(page, dtype=np.uint8)
+    if dark_ink is None:
+        dark_ink = np.median(page) > 127
+    return 255 - page if dark_ink else page
+
+class Segmentation():
+    def __init__(self, boxes:np.ndarray, images:np.ndarray):
+        """
+        boxes: (n x 4) int32 top, left, bottom, right (exclusive) of each character in the page, in reading order
+        images: (n x 784) uint8 characters normalized as the MNIST images
+        """
+        self.boxes = boxes
+        self.images = images
+
+    def __len__(self):
+        return len(self.boxes)
+
+def _reading_order(boxes:np.ndarray) -> np.ndarray:
+    # lines of text: characters whose vertical centers are closer than the median height
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    heights = boxes[:, 2] - boxes[:, 0]
+    centers = (boxes[:, 0] + boxes[:, 2])/2
+    order = np.argsort(centers, kind='stable')
+    line = np.zeros(len(boxes), dtype=np.int64)
+    line[order[1:]] = np.cumsum(np.diff(centers[order]) > np.median(heights)/2)
+    return np.lexsort((boxes[:, 1], line))
+
+def find_characters(ink:np.ndarray, threshold:int=None, min_area:int=10, max_area:int=None,
+                    merge_distance:int=1):
+    """
+    Connected components of ink pixels (8-connectivity)
+
+    threshold: ink above it is part of a character (default: otsu_threshold)
+    min_area: smaller components (noise, dust) are ignored
+    max_area: larger components (lines and boxes of the form) are ignored
+    merge_distance: parts of a character closer than this (pixels) are joined (e.g. a broken 5)
+
+    Returns (labels image, component ids of the characters, boxes), in reading order
+    """
+    if threshold is None:
+        threshold = otsu_threshold(ink)
+    binary = ink > threshold
+    structure = np.ones((3, 3), dtype=bool)
+    if merge_distance > 0:
+        labels, num_components = ndimage.label(ndimage.binary_dilation(binary, structure, merge_distance), structure)
+        labels[~binary] = 0
+    else:
+        labels, num_components = ndimage.label(binary, structure)
+
+    areas = np.bincount(labels.ravel(), minlength=num_components+1)
+    ids = np.arange(1, num_components+1)
+    slices = ndimage.find_objects(labels)
+    # components emptied by the ink mask (only dilation) have no slice
+    valid = np.array([slice_ is not None for slice_ in slices], dtype=bool) & (areas[1:] >= min_area)
+    if max_area is not None:
+        valid &= areas[1:] <= max_area
+    ids = ids[valid]
+    boxes = np.array([(slices[i-1][0].start, slices[i-1][1].start, slices[i-1][0].stop, slices[i-1][1].stop)
+                        for i in ids], dtype=np.int32).reshape(-1, 4)
+    order = _reading_order(boxes)
+    return labels, ids[order], boxes[order]
+
+def _nearest(image:np.ndarray, rows:np.ndarray, columns:np.ndarray) -> np.ndarray:
+    # value of the pixel at each (row, column) position, 0 outside the image
+    rows = np.rint(rows).astype(np.int64)
+    columns = np.rint(columns).astype(np.int64)
+    inside = (rows >= 0) & (rows < image.shape[0]) & (columns >= 0) & (columns < image.shape[1])
+    return np.where(inside, image[np.clip(rows, 0, image.shape[0]-1), np.clip(columns, 0, image.shape[1]-1)], 0)
+
+def normalize_characters(ink:np.ndarray, labels:np.ndarray, ids:np.ndarray, boxes:np.ndarray,
+                        side:int=SQUARE_REFERENCE, glyph_box:int=GLYPH_BOX, num_subsamples:int=2) -> np.ndarray:
+    """
+    (n x side*side) uint8 images of the characters, as the MNIST preprocessing: each one scaled
+    (keeping its aspect ratio) to fit in glyph_box x glyph_box and centered by its center of mass.
+    All characters are sampled at once (map_coordinates), num_subsamples^2 samples per pixel.
+    """
+    if len(ids) == 0:
+        return np.zeros((0, side*side), dtype=np.uint8)
+    ink = np.asarray(ink, dtype=np.float32)
+    heights = (boxes[:, 2] - boxes[:, 0]).astype(np.float64)
+    widths = (boxes[:, 3] - boxes[:, 1]).astype(np.float64)
+    # page pixels per image pixel
+    scale = np.maximum(heights, widths)/glyph_box
+    centers = np.array(ndimage.center_of_mass(ink, labels, ids)).reshape(-1, 2)
+
+    # position, in the page, of every subsample of every image pixel: (n, side*s, side*s)
+    offsets = (np.arange(side*num_subsamples) + 0.5)/num_subsamples - side/2
+    rows = centers[:, 0, np.newaxis, np.newaxis] + scale[:, np.newaxis, np.newaxis]*offsets[np.newaxis, :, np.newaxis]
+    columns = centers[:, 1, np.newaxis, np.newaxis] + scale[:, np.newaxis, np.newaxis]*offsets[np.newaxis, np.newaxis, :]
+    rows, columns = np.broadcast_arrays(rows, columns)
+
+    values = ndimage.map_coordinates(ink, np.stack((rows.ravel(), columns.ravel())), order=1, cval=0.0).reshape(rows.shape)
+    # only the ink of the character itself (not of its neighbours)
+    owner = _nearest(labels, rows, columns)
+    values[owner != ids[:, np.newaxis, np.newaxis]] = 0
+
+    images = values.reshape(len(ids), side, num_subsamples, side, num_subsamples).mean(axis=(2, 4))
+    # strokes as dark as the MNIST ones
+    maximum = images.reshape(len(ids), -1).max(axis=1)
+    images *= np.divide(255.0, maximum, out=np.zeros_like(maximum), where=maximum > 0)[:, np.newaxis, np.newaxis]
+    return np.clip(np.rint(images), 0, 255).astype(np.uint8).reshape(len(ids), side*side)
+
+def segment_page(page:np.ndarray, dark_ink:bool=None, threshold:int=None, min_area:int=10,
+                max_area:int=None, merge_distance:int=1) -> Segmentation:
+    """
+    Characters of a page (grayscale uint8), normalized as 28x28 MNIST images
+    """
+    ink = ink_image(page, dark_ink)
+    labels, ids, boxes = find_characters(ink, threshold, min_area, max_area, merge_distance)
+    return Segmentation(boxes, normalize_characters(ink, labels, ids, boxes))
+
+class PageResult():
+    def __init__(self, boxes:np.ndarray, predictions:np.ndarray, timings:dict):
+        """
+        boxes: (n x 4) top, left, bottom, right of each character, in reading order
+        predictions: category of each character
+        timings: seconds spent in 'segment', 'predict' and 'total'
+        """
+        self.boxes = boxes
+        self.predictions = predictions
+        self.timings = timings
+
+    def __len__(self):
+        return len(self.boxes)
+
+class PageRecognizer():
+    def __init__(self, method, filtr_array:list=None, binary:bool=False, batch_size:int=256,
+                dark_ink:bool=None, threshold:int=None, min_area:int=10, max_area:int=None, merge_distance:int=1):
+        """
+        Segment pages and classify their characters with a fitted MachineLearningMethod.
+
+        filtr_array: pixels used by the method (create_filter_array, e.g. the 20x20 crop), None for all 784
+        binary: pixels above 0 become 1 (methods trained with create_binary_base files)
+        batch_size: characters predicted at once
+        (the other parameters are the ones of segment_page)
+        """
+        self.method = method
+        self.filtr_array = filtr_array
+        self.binary = binary
+        self.batch_size = batch_size
+        self.segment_options = {'dark_ink': dark_ink, 'threshold': threshold, 'min_area': min_area,
+                                'max_area': max_area, 'merge_distance': merge_distance}
+
+    def preprocess(self, images:np.ndarray) -> np.ndarray:
+        # the same transformations used to create the training files
+        return preprocess_pixels(images, self.filtr_array, self.binary)
+
+    def recognize(self, page:np.ndarray) -> PageResult:
+        start = time.perf_counter()
+        segmentation = segment_page(page, **self.segment_options)
+        segment_time = time.perf_counter() - start
+
+        images = self.preprocess(segmentation.images)
+        arr_predictions = [self.method.predict(images[ini:ini+self.batch_size]) for ini in range(0, len(images), self.batch_size)]
+        predictions = np.concatenate(arr_predictions) if arr_predictions else np.zeros(0, dtype=np.int64)
+        total_time = time.perf_counter() - start
+        return PageResult(segmentation.boxes, predictions, {'segment': segment_time, 'predict': total_time - segment_time,
+                                                            'total': total_time})
+
+    def recognize_pages(self, pages:Iterable[np.ndarray]) -> Iterator[PageResult]:
+        """
+        Results of each page (arrays or file names), one page in memory at a time
+        """
+        for page in pages:
+            yield self.recognize(load_page(page) if isinstance(page, str) else page)
+
+def pages_per_second(page_results:List[PageResult]) -> dict:
+    total_time = sum(page_result.timings['total'] for page_result in page_results)
+    num_characters = sum(len(page_result) for page_result in page_results)
+    return {'pages': len(page_results), 'characters': num_characters, 'seconds': total_time,
+            'pages_per_second': len(page_results)/total_time if total_time > 0 else 0.0,
+            'characters_per_second': num_characters/total_time if total_time > 0 else 0.0,
+            'segment_seconds': sum(page_result.timings['segment'] for page_result in page_results)}
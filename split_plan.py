@@ -0,0 +1,101 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import List, Tuple, Union
+
+from results import Fold, FoldData
+
+Split = Tuple[np.ndarray, np.ndarray]
+
+def _labels_checksum(y:np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(np.asarray(y, dtype=np.int64)).tobytes(), digest_size=16).hexdigest()
+
+def stratified_splits(y:np.ndarray, rows:np.ndarray, num_folds:int, num_repetitions:int=1, seed:int=1) -> List[Split]:
+    """
+    (practice rows, rows to predict) of num_folds folds for each repetition. Every fold gets the same
+    number (+-1) of rows of each category, so small folds keep the proportion of the digits.
+
+    y: category of every row of the data
+    rows: rows (int32) to be split
+    """
+    arr_splits = []
+    for index in range(num_repetitions):
+        random_state = np.random.RandomState(seed+index)
+        # shuffle, then order by category (stable): consecutive rows of a category go to consecutive folds
+        rows_rand = rows[random_state.permutation(len(rows))]
+        rows_rand = rows_rand[np.argsort(y[rows_rand], kind='stable')]
+        # a random first fold for each repetition, so the leftover rows of a category are not always in fold 0
+        fold_of_position = (np.arange(len(rows_rand)) + random_state.randint(num_folds)) % num_folds
+
+        for num_fold in range(num_folds):
+            predict_rows = np.sort(rows_rand[fold_of_position == num_fold])
+            practice_rows = np.sort(rows_rand[fold_of_position != num_fold])
+            arr_splits.append((practice_rows.astype(np.int32), predict_rows.astype(np.int32)))
+    return arr_splits
+
+class SplitPlan():
+    def __init__(self, num_rows:int, labels_checksum:str, outer_splits:List[Split], inner_splits:List[List[Split]]):
+        """
+        Every outer (test) and inner (validation) split of an experiment as int32 row indices.
+        Create it with SplitPlan.stratified, store it with save and reuse it with load, so runs
+        on the same data are exactly repeatable.
+
+        outer_splits: (practice rows, rows to predict) of each fold
+        inner_splits: validation splits (over the same data) of each fold
+        """
+        self.num_rows = num_rows
+        self.labels_checksum = labels_checksum
+        self.outer_splits = outer_splits
+        self.inner_splits = inner_splits
+
+    @staticmethod
+    def stratified(y:np.ndarray, num_folds:int, num_repetitions:int=1, seed:int=1,
+                    num_folds_validation:int=0, num_repetitions_validation:int=1) -> "SplitPlan":
+        """
+        y: category of every row
+        num_folds: k of the outer cross validation (num_threshold of Fold.generate_k_folds is num_repetitions)
+        num_folds_validation: k of the cross validation inside the practice rows of each fold (0 for none)
+        """
+        y = np.asarray(y)
+        outer_splits = stratified_splits(y, np.arange(len(y), dtype=np.int32), num_folds, num_repetitions, seed)
+        inner_splits = []
+        for practice_rows, _ in outer_splits:
+            if num_folds_validation > 0:
+                inner_splits.append(stratified_splits(y, practice_rows, num_folds_validation, num_repetitions_validation, seed))
+            else:
+                inner_splits.append([])
+        return SplitPlan(len(y), _labels_checksum(y), outer_splits, inner_splits)
+
+    def __len__(self):
+        return len(self.outer_splits)
+
+    def folds(self, df_data:Union[pd.DataFrame, FoldData], col_category:str) -> List[Fold]:
+        """
+        Folds of the plan over df_data (DataFrame or FoldData), which must be the data used to create the plan.
+        The folds only keep indices, DataFrames and validation folds are created when first used.
+        """
+        data = df_data if isinstance(df_data, FoldData) else FoldData.from_dataframe(df_data, col_category)
+        if len(data) != self.num_rows or _labels_checksum(data.y) != self.labels_checksum:
+            raise ValueError("The data is not the one used to create this split plan")
+        return [Fold.from_indices(data, practice_rows, predict_rows, validation_splits=inner)
+                for (practice_rows, predict_rows), inner in zip(self.outer_splits, self.inner_splits)]
+
+    def save(self, file_name:str) -> None:
+        arrays = {}
+        for num_fold, (practice_rows, predict_rows) in enumerate(self.outer_splits):
+            arrays[f"outer_{num_fold}_practice"] = practice_rows
+            arrays[f"outer_{num_fold}_predict"] = predict_rows
+            for num_validation, (practice_rows, predict_rows) in enumerate(self.inner_splits[num_fold]):
+                arrays[f"inner_{num_fold}_{num_validation}_practice"] = practice_rows
+                arrays[f"inner_{num_fold}_{num_validation}_predict"] = predict_rows
+        np.savez_compressed(file_name, num_rows=self.num_rows, labels_checksum=self.labels_checksum,
+                            num_inner=np.array([len(inner) for inner in self.inner_splits]), **arrays)
+
+    @staticmethod
+    def load(file_name:str) -> "SplitPlan":
+        with np.load(file_name) as file:
+            num_inner = file['num_inner']
+            outer_splits = [(file[f"outer_{num_fold}_practice"], file[f"outer_{num_fold}_predict"]) for num_fold in range(len(num_inner))]
+            inner_splits = [[(file[f"inner_{num_fold}_{num_validation}_practice"], file[f"inner_{num_fold}_{num_validation}_predict"])
+                            for num_validation in range(num_inner[num_fold])] for num_fold in range(len(num_inner))]
+            return SplitPlan(int(file['num_rows']), str(file['labels_checksum']), outer_splits, inner_splits)
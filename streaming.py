@@ -0,0 +1,98 @@
+import numpy as np
+from typing import Iterator, List, Tuple
+
+from dataset_store import DatasetStore, unpack_binary_images
+from file_pipeline import DropMissingStage, Stage, read_chunks
+from results import Result
+
+class CsvChunkSource():
+    def __init__(self, file_name:str, chunk_size:int=4096, stages:List[Stage]=None):
+        """
+        Rows of a pixel csv (pixel columns followed by the category column), chunk_size rows at a time.
+        Every iteration reads the file again, so only one chunk is in memory.
+
+        stages: file_pipeline stages applied to every chunk (default: drop rows with missing values)
+        """
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.stages = [DropMissingStage()] if stages is None else stages
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """
+        (position of the first row, pixels, categories) of each chunk
+        """
+        num_rows = 0
+        with open(self.file_name, 'r') as file:
+            header = file.readline().rstrip('\r\n').split(',')
+            for chunk in read_chunks(file, len(header), self.chunk_size):
+                for stage in self.stages:
+                    chunk = stage(chunk)
+                yield num_rows, chunk.pixels, chunk.labels
+                num_rows += len(chunk)
+
+class StoreChunkSource():
+    def __init__(self, store:DatasetStore, chunk_size:int=4096, feature_indices:np.ndarray=None):
+        """
+        Rows of a DatasetStore, chunk_size rows at a time (packed stores are unpacked chunk by chunk)
+
+        feature_indices: keep only these pixel columns (e.g. from feature_selection.select_features)
+        """
+        self.store = store
+        self.chunk_size = chunk_size
+        self.feature_indices = feature_indices
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        raw_pixels = self.store.raw_pixels
+        labels = self.store.labels
+        for ini in range(0, len(self.store), self.chunk_size):
+            pixels = raw_pixels[ini:ini+self.chunk_size]
+            if self.store.packed:
+                pixels = unpack_binary_images(pixels, self.store.num_features)
+            if self.feature_indices is not None:
+                pixels = pixels[:, self.feature_indices]
+            yield ini, np.asarray(pixels), np.asarray(labels[ini:ini+self.chunk_size])
+
+def fold_of_rows(rows:np.ndarray, num_folds:int, seed:int=1) -> np.ndarray:
+    """
+    Fold (0..num_folds-1) of each row position, from a hash (splitmix64) of the position and the seed.
+    It does not depend on the chunk size, so every pass over the data sees the same folds.
+    """
+    with np.errstate(over='ignore'):
+        value = np.asarray(rows, dtype=np.uint64) + np.uint64(seed)*np.uint64(0x9E3779B97F4A7C15)
+        value = (value ^ (value >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        value = (value ^ (value >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        value = value ^ (value >> np.uint64(31))
+    return (value % np.uint64(num_folds)).astype(np.int64)
+
+class StreamingFold():
+    def __init__(self, source, fold_number:int, num_folds:int, seed:int=1):
+        """
+        Fold of a chunk source (CsvChunkSource or StoreChunkSource) that is never fully in memory:
+        the rows assigned (by fold_of_rows) to fold_number are predicted, the others are the practice rows.
+        """
+        self.source = source
+        self.fold_number = fold_number
+        self.num_folds = num_folds
+        self.seed = seed
+
+    @staticmethod
+    def generate_k_folds(source, num_folds:int, seed:int=1) -> List["StreamingFold"]:
+        return [StreamingFold(source, fold_number, num_folds, seed) for fold_number in range(num_folds)]
+
+    def _chunks(self, to_predict:bool) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        for ini, pixels, labels in self.source:
+            selected = (fold_of_rows(np.arange(ini, ini+len(labels)), self.num_folds, self.seed) == self.fold_number) == to_predict
+            if selected.any():
+                yield pixels[selected], labels[selected]
+
+    def practice_chunks(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return self._chunks(False)
+
+    def predict_chunks(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return self._chunks(True)
+
+def evaluate_stream(source, ml_method, num_folds:int=5, seed:int=1) -> List[Result]:
+    """
+    Result of each fold of a chunk source, with a method that supports chunks (e.g. StreamingMachineLearning)
+    """
+    return [ml_method.eval_fold(fold) for fold in StreamingFold.generate_k_folds(source, num_folds, seed)]
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules live in the repository root (there is no package)
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import optuna
+import pandas as pd
+import pytest
+
+from conftest import REPO_DIR
+from augmentation import Augmenter, AugmentedFold
+from evaluation import Experiment, GoalOptimizationDecisionTree
+from results import Fold
+
+optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+@pytest.fixture(scope='module')
+def folds():
+    df_data = pd.read_csv(os.path.join(REPO_DIR, 'mnist_evaluation.csv'))
+    return Fold.generate_k_folds(df_data, val_k=3, col_category='y_class', num_folds_validation=2)
+
+def test_variants_are_deterministic_and_rows_to_predict_clean(folds):
+    chunks = list(AugmentedFold(folds[0], Augmenter(), num_copies=2, chunk_size=300).practice_chunks())
+    again = list(AugmentedFold(folds[0], Augmenter(), num_copies=2, chunk_size=300).practice_chunks())
+    assert all((x == x_again).all() and (y == y_again).all() for (x, y), (x_again, y_again) in zip(chunks, again))
+    assert sum(len(y) for _, y in chunks) == 3*len(folds[0].practice_indices)
+    # the variants are not the original rows
+    assert (chunks[1][0] != chunks[0][0]).any()
+
+    x_to_predict = np.concatenate([x for x, _ in AugmentedFold(folds[0], Augmenter()).predict_chunks()])
+    assert (x_to_predict == folds[0].x_to_predict).all()
+
+def test_to_fold_has_the_variants_of_practice_chunks(folds):
+    augmented_fold = AugmentedFold(folds[0], Augmenter(), num_copies=2, chunk_size=300)
+    fold = augmented_fold.to_fold()
+    x_chunks = np.concatenate([x for x, _ in augmented_fold.practice_chunks()])
+    assert sorted(map(bytes, fold.x_practice)) == sorted(map(bytes, x_chunks))
+    assert (fold.x_to_predict == folds[0].x_to_predict).all()
+
+    # a validation fold never learns from the variants of the rows it predicts
+    assert len(fold.arr_folds_validation) == len(folds[0].arr_folds_validation)
+    for fold_validation in fold.arr_folds_validation:
+        labels_practice = fold.data.index[fold_validation.practice_indices]
+        labels_to_predict = fold.data.index[fold_validation.predict_indices]
+        assert len(np.intersect1d(labels_practice, labels_to_predict)) == 0
+        assert len(fold_validation.practice_indices) == 3*len(np.unique(labels_practice))
+
+def test_experiment_runs_on_augmented_folds(folds):
+    arr_folds = [AugmentedFold(fold, Augmenter()).to_fold() for fold in folds[:2]]
+    exp = Experiment(arr_folds, None, GoalOptimizationDecisionTree, num_trials=2)
+    assert 0 < exp.macro_f1_avg <= 1
+
+def test_augmentation_does_not_import_sklearn():
+    code = "import sys, augmentation; print(any(name.split('.')[0] in ('sklearn', 'joblib') for name in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == 'False'
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+import time
+from types import SimpleNamespace
+
+from benchmark import run_benchmarks, _wait_result
+
+def test_failed_benchmark_is_reported():
+    options = SimpleNamespace(repeat=1, num_trials=1, timeout=60)
+    # 2 rows: the folds have no practice rows, sklearn raises in the child process
+    results = run_benchmarks(['experiment'], [2], [400], options)['results']
+    assert 'Found array with 0 sample(s)' in results['experiment[rows=2,features=400]']['error']
+
+def test_dead_or_slow_process_is_reported():
+    context = multiprocessing.get_context('spawn')
+    # as a process killed when out of memory: it ends without putting a result
+    queue = context.Queue()
+    process = context.Process(target=os._exit, args=(9,))
+    process.start()
+    assert 'exited with code 9' in _wait_result(process, queue)['error']
+    process.join()
+
+    queue = context.Queue()
+    process = context.Process(target=time.sleep, args=(60,))
+    process.start()
+    assert 'timeout' in _wait_result(process, queue, timeout=1)['error']
+    process.join()
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import REPO_DIR
+from benchmark import IMPORT_TARGET, IMPORT_TARGETS, check_imports
+
+@pytest.mark.parametrize('command', list(IMPORT_TARGETS))
+def test_help_starts_fast(command):
+    # the help of every subcommand (run-experiment too) loads none of its modules
+    max_time, _ = IMPORT_TARGET
+    arr_times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'cli.py', command, '-h'], cwd=REPO_DIR, capture_output=True, check=True)
+        arr_times.append(time.perf_counter() - start)
+    assert min(arr_times) < max_time
+
+@pytest.mark.parametrize('command', list(IMPORT_TARGETS))
+def test_command_imports_within_target(command):
+    # a new interpreter importing cli and every module the subcommand uses
+    max_time, max_rss = IMPORT_TARGETS[command]
+    values = check_imports([command], repeat=3)[f"import[{command}]"]
+    assert values['wall_time_s'] < max_time, f"{values['wall_time_s']:.3f}s"
+    assert values['peak_rss_mb'] < max_rss, f"{values['peak_rss_mb']:.1f}MB"
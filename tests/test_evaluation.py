@@ -0,0 +1,65 @@
+import os
+import optuna
+import pandas as pd
+import pytest
+
+from conftest import REPO_DIR
+from evaluation import Experiment, GoalOptimizationDecisionTree, GoalOptimizationRandomForest
+from results import Fold
+
+optuna.logging.set_verbosity(optuna.logging.WARNING)
+
+@pytest.fixture(scope='module')
+def folds():
+    df_data = pd.read_csv(os.path.join(REPO_DIR, 'mnist_sample_feature_select.csv'))
+    return Fold.generate_k_folds(df_data, val_k=3, col_category='y_class', num_folds_validation=2)
+
+def _search(goal, num_trials):
+    study = optuna.create_study(sampler=optuna.samplers.TPESampler(seed=1, n_startup_trials=10), direction='maximize')
+    study.optimize(goal, n_trials=num_trials)
+    return [trial.value for trial in study.trials]
+
+def test_reused_trees_give_the_same_trials(folds):
+    goal_pool = GoalOptimizationRandomForest(folds[0], reuse_trees=True)
+    values_pool = _search(goal_pool, 30)
+    values = _search(GoalOptimizationRandomForest(folds[0], param_step=0.05), 30)
+
+    assert values_pool == values
+    assert goal_pool.tree_pool.num_trees_reused > 0
+
+class CountingGoal(GoalOptimizationDecisionTree):
+    def __init__(self, fold):
+        super().__init__(fold)
+        self.arr_evaluated_folds = []
+
+    def _eval_validation(self, method, num_fold, fold_validation):
+        self.arr_evaluated_folds.append(num_fold)
+        return super()._eval_validation(method, num_fold, fold_validation)
+
+class PruneAlways(optuna.pruners.BasePruner):
+    def prune(self, study, trial):
+        return True
+
+@pytest.mark.parametrize('n_jobs, num_evaluated', [(1, 1), (2, 2), (4, 4)])
+def test_pruned_trial_skips_the_next_waves(n_jobs, num_evaluated):
+    df_data = pd.read_csv(os.path.join(REPO_DIR, 'mnist_sample_feature_select.csv'))
+    fold = Fold.generate_k_folds(df_data, val_k=3, col_category='y_class', num_folds_validation=4)[0]
+    goal = CountingGoal(fold)
+    goal.n_jobs = n_jobs
+    study = optuna.create_study(pruner=PruneAlways(), direction='maximize')
+    study.optimize(goal, n_trials=1)
+    assert study.trials[0].state == optuna.trial.TrialState.PRUNED
+    assert sorted(goal.arr_evaluated_folds) == list(range(num_evaluated))
+
+def _experiment(folds, n_jobs, n_jobs_validation):
+    exp = Experiment(folds, None, GoalOptimizationDecisionTree, num_trials=12,
+                     sampler=optuna.samplers.TPESampler(seed=1, n_startup_trials=5),
+                     n_jobs=n_jobs, n_jobs_validation=n_jobs_validation)
+    macro_f1_avg = exp.macro_f1_avg
+    return [[trial.value for trial in study.trials] for study in exp.studies_per_fold], macro_f1_avg
+
+def test_results_do_not_depend_on_n_jobs(folds):
+    values, macro_f1_avg = _experiment(folds, n_jobs=1, n_jobs_validation=1)
+
+    assert _experiment(folds, n_jobs=3, n_jobs_validation=1) == (values, macro_f1_avg)
+    assert _experiment(folds, n_jobs=1, n_jobs_validation=2) == (values, macro_f1_avg)
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import REPO_DIR
+from file_pipeline import preprocess_pixels
+from work_methods import create_filter_array, create_selected_base, create_binary_base
+
+def test_preprocess_pixels_matches_the_training_files(tmp_path):
+    input_file_name = os.path.join(REPO_DIR, 'mnist_evaluation.csv')
+    filtr_array = create_filter_array(28, 4, 4, 24, 24)
+    selected_file_name = str(tmp_path/'selected.csv')
+    binary_file_name = str(tmp_path/'binary.csv')
+    create_selected_base(input_file_name, selected_file_name, filtr_array)
+    create_binary_base(selected_file_name, binary_file_name)
+
+    # a file without missing values, so both have the same rows
+    images = pd.read_csv(input_file_name).drop('y_class', axis=1).to_numpy(dtype=np.uint8)
+    for file_name, binary in ((selected_file_name, False), (binary_file_name, True)):
+        expected = pd.read_csv(file_name).drop('y_class', axis=1).to_numpy()
+        assert (preprocess_pixels(images, filtr_array, binary) == expected).all()
+
+DATA_DIR = os.path.join(REPO_DIR, 'tests', 'data')
+
+@pytest.mark.parametrize('chunk_size', [4096, 7])
+def test_generated_files_match_the_expected_output(tmp_path, chunk_size):
+    # expected files written by the previous, line by line, create_selected_base and create_binary_base
+    filtr_array = create_filter_array(28, 4, 4, 24, 24)
+    selected_file_name = str(tmp_path/'selected.csv')
+    binary_file_name = str(tmp_path/'binary.csv')
+    create_selected_base(os.path.join(DATA_DIR, 'mnist_sample.csv'), selected_file_name, filtr_array, chunk_size)
+    create_binary_base(selected_file_name, binary_file_name, chunk_size)
+
+    for file_name, expected_file_name in ((selected_file_name, 'mnist_sample_selected.csv'),
+                                          (binary_file_name, 'mnist_sample_selected_binary.csv')):
+        with open(file_name, 'rb') as file, open(os.path.join(DATA_DIR, expected_file_name), 'rb') as expected_file:
+            assert file.read() == expected_file.read()
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import numpy as np
+
+from inference_server import InferenceServer, NUM_PIXELS
+
+class ConstantMethod():
+    def predict(self, x):
+        return np.full(len(x), 7)
+
+class FailingMethod():
+    def predict(self, x):
+        raise RuntimeError("model failure")
+
+async def _requests(method, arr_requests):
+    # responses of requests sent one after another over the same keep-alive connection
+    server = InferenceServer(method)
+    await server.start()
+    tcp_server = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+    port = tcp_server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    try:
+        for content_type, body in arr_requests:
+            writer.write(f"POST /predict HTTP/1.1\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode()+body)
+            await writer.drain()
+            status = (await reader.readline()).decode().split(' ', 2)[1]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            responses.append((int(status), json.loads(await reader.readexactly(int(headers['content-length'])))))
+    finally:
+        writer.close()
+        tcp_server.close()
+        await server.stop()
+    return responses
+
+def test_requests_without_images_are_rejected():
+    image = bytes(NUM_PIXELS)
+    responses = asyncio.run(_requests(ConstantMethod(), [('application/octet-stream', b''),
+                                                        ('application/json', b'{"images": []}'),
+                                                        ('application/octet-stream', image)]))
+    assert [status for status, _ in responses] == [400, 400, 200]
+    assert responses[2][1] == {'predictions': [7]}
+
+def test_model_failure_returns_500_and_keeps_the_connection():
+    image = bytes(NUM_PIXELS)
+    responses = asyncio.run(_requests(FailingMethod(), [('application/octet-stream', image),
+                                                        ('application/octet-stream', image)]))
+    assert [status for status, _ in responses] == [500, 500]
+    assert 'model failure' in responses[0][1]['error']
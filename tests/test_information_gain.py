@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import REPO_DIR
+from information_gain import (information_gain, discrete_information_gain,
+                              information_gain_matrix, discrete_information_gain_matrix)
+
+@pytest.fixture(scope='module')
+def df_data():
+    df_data = pd.read_csv(os.path.join(REPO_DIR, 'mnist_sample_feature_select.csv'))
+    # a sample of the pixel columns
+    feature_names = list(df_data.columns.drop('y_class')[::37])
+    df_data = df_data[feature_names + ['y_class']].copy()
+    # a constant column and real values with missing cells
+    df_data['constant'] = 7
+    rng = np.random.RandomState(1)
+    df_data['real'] = np.where(rng.rand(len(df_data)) < 0.1, np.nan, rng.normal(size=len(df_data)))
+    return df_data
+
+def test_information_gain_matrix_matches_information_gain(df_data):
+    matrix = information_gain_matrix(df_data, 'y_class', chunk_size=100)
+    expected = [information_gain(df_data, 'y_class', feature_name) for feature_name in matrix.index]
+
+    assert np.allclose(matrix.to_numpy(), expected, rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize('num_bins', [2, 5])
+def test_discrete_information_gain_matrix_matches_discrete_information_gain(df_data, num_bins):
+    matrix = discrete_information_gain_matrix(df_data, 'y_class', num_bins, chunk_size=100)
+    expected = [discrete_information_gain(df_data, 'y_class', feature_name, num_bins) for feature_name in matrix.index]
+
+    assert np.allclose(matrix.to_numpy(), expected, rtol=0, atol=1e-12)
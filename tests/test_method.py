@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from conftest import REPO_DIR
+from evaluation import Experiment, GoalOptimizationDecisionTree
+from method import MachineLearningMethod, ScikitLearnMachineLearning, RandomForestTreePool
+from results import Fold
+
+@pytest.fixture(scope='module')
+def folds():
+    df_data = pd.read_csv(os.path.join(REPO_DIR, 'mnist_sample_feature_select.csv'))
+    return Fold.generate_k_folds(df_data, val_k=3, col_category='y_class', num_folds_validation=2)
+
+def test_saved_method_evaluates_after_load(folds, tmp_path):
+    method = ScikitLearnMachineLearning(RandomForestClassifier(n_estimators=3, random_state=2), tree_pool=RandomForestTreePool())
+    expected = method.eval_fold(folds[0])
+    file_name = str(tmp_path/'method.joblib')
+    method.save(file_name)
+
+    loaded = MachineLearningMethod.load(file_name)
+    assert loaded.cache is None and loaded.tree_pool is None
+    assert (loaded.predict(folds[0].x_to_predict) == method.predict(folds[0].x_to_predict)).all()
+    assert loaded.eval_fold(folds[0]).macro_f1 == expected.macro_f1
+
+def test_experiment_best_method_evaluates_after_load(folds, tmp_path):
+    exp = Experiment(folds[:1], None, GoalOptimizationDecisionTree, num_trials=2)
+    exp.calculate_results()
+    file_name = str(tmp_path/'best_method.joblib')
+    exp.best_methods_per_fold[0].save(file_name)
+
+    loaded = MachineLearningMethod.load(file_name)
+    assert loaded.eval_fold(folds[0]).macro_f1 == exp.results[0].macro_f1
+
+def test_best_method_survives_cache_eviction(folds, tmp_path):
+    from sklearn.tree import DecisionTreeClassifier
+    from evaluation import _evaluate_fold
+    from model_cache import ModelCache
+    cache = ModelCache(str(tmp_path/'cache'))
+    ScikitLearnMachineLearning(DecisionTreeClassifier(random_state=2), cache=cache).eval_fold(folds[0])
+
+    # a cache hit only keeps the key of the model
+    method = ScikitLearnMachineLearning(DecisionTreeClassifier(random_state=2))
+    result, _, best_method, _, _ = _evaluate_fold(folds[0], 0, method, None, 0, None, 1, cache=cache)
+    assert cache.hits == 1
+    # the entry is evicted by a later put
+    cache.max_bytes = 0
+    ScikitLearnMachineLearning(DecisionTreeClassifier(random_state=3), cache=cache).eval_fold(folds[1])
+    assert cache.stats['entries'] == 0
+
+    file_name = str(tmp_path/'best_method.joblib')
+    best_method.save(file_name)
+    assert MachineLearningMethod.load(file_name).eval_fold(folds[0]).macro_f1 == result.macro_f1
@@ -0,0 +1,173 @@
+import contextvars
+import cProfile
+import heapq
+import json
+import marshal
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+# tags (fold, trial, validation_fold...) added to every span of the current context
+_trace_tags = contextvars.ContextVar('trace_tags', default={})
+
+_NULL_SPAN = nullcontext()
+
+class NullTracer():
+    """
+    Tracer used when tracing is disabled, every call does nothing
+    """
+    enabled = False
+
+    def span(self, name:str, **args):
+        return _NULL_SPAN
+
+    def tags(self, **tags):
+        return _NULL_SPAN
+
+    def profile(self, trial_number:int):
+        return _NULL_SPAN
+
+    def new_child(self) -> "NullTracer":
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def merge(self, other) -> None:
+        pass
+
+NULL_TRACER = NullTracer()
+
+class Tracer():
+    enabled = True
+
+    def __init__(self, profile_slowest:int=0):
+        """
+        Record the duration of each step (spans) of an Experiment.
+
+        profile_slowest: keep the cProfile stats of this number of slowest trials (0 disables the profiler)
+        """
+        self.profile_slowest = profile_slowest
+        self.events:List[dict] = []
+        # heap of (duration, order, trial number, fold, pstats data) of the slowest trials
+        self.profiles:List[tuple] = []
+        self._num_profiled = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # copies of a method keep recording in the same tracer
+        return self
+
+    @contextmanager
+    def span(self, name:str, **args):
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            event = {'name': name, 'start': start_time, 'duration': duration, 'pid': os.getpid(),
+                    'tid': threading.get_ident(), 'args': {**_trace_tags.get(), **args}}
+            with self._lock:
+                self.events.append(event)
+
+    @contextmanager
+    def tags(self, **tags):
+        token = _trace_tags.set({**_trace_tags.get(), **tags})
+        try:
+            yield
+        finally:
+            _trace_tags.reset(token)
+
+    def current_tags(self) -> dict:
+        return dict(_trace_tags.get())
+
+    @contextmanager
+    def profile(self, trial_number:int):
+        """
+        Profile a trial, its stats are kept if it is one of the profile_slowest slowest
+        """
+        if self.profile_slowest <= 0:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            with self._lock:
+                # order breaks ties between equal durations
+                self._num_profiled += 1
+                entry = (duration, self._num_profiled, trial_number, _trace_tags.get().get('fold'), pstats.Stats(profiler).stats)
+                if len(self.profiles) < self.profile_slowest:
+                    heapq.heappush(self.profiles, entry)
+                elif duration > self.profiles[0][0]:
+                    heapq.heapreplace(self.profiles, entry)
+
+    def new_child(self) -> "Tracer":
+        # empty tracer with the same configuration (e.g. for a fold running in another process)
+        return Tracer(self.profile_slowest)
+
+    def merge(self, other:"Tracer") -> None:
+        with self._lock:
+            self.events.extend(other.events)
+            for duration, _, trial_number, fold, stats in other.profiles:
+                self._num_profiled += 1
+                entry = (duration, self._num_profiled, trial_number, fold, stats)
+                if len(self.profiles) < self.profile_slowest:
+                    heapq.heappush(self.profiles, entry)
+                elif entry[0] > self.profiles[0][0]:
+                    heapq.heapreplace(self.profiles, entry)
+
+    def totals(self, **tags) -> Dict[str, float]:
+        """
+        Total duration (seconds) per span name, only spans with the given tags
+        """
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            if all(event['args'].get(tag) == value for tag, value in tags.items()):
+                totals[event['name']] = totals.get(event['name'], 0.0) + event['duration']
+        return totals
+
+    def to_chrome_trace(self) -> dict:
+        """
+        Timeline in the Chrome trace format (chrome://tracing or https://ui.perfetto.dev)
+        """
+        return {'traceEvents': [{'name': event['name'], 'ph': 'X', 'ts': event['start']*1e6, 'dur': event['duration']*1e6,
+                                'pid': event['pid'], 'tid': event['tid'], 'args': event['args']} for event in self.events],
+                'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, file_name:str) -> None:
+        with open(file_name, 'w') as file:
+            json.dump(self.to_chrome_trace(), file)
+
+    def dump_profiles(self, directory:str) -> List[str]:
+        """
+        Write the stats of the slowest trials (readable with pstats or snakeviz), slowest first
+        """
+        os.makedirs(directory, exist_ok=True)
+        arr_file_names = []
+        for duration, _, trial_number, fold, stats in sorted(self.profiles, key=lambda entry: entry[0], reverse=True):
+            file_name = os.path.join(directory, f"fold_{fold}_trial_{trial_number}.prof")
+            with open(file_name, 'wb') as file:
+                marshal.dump(stats, file)
+            arr_file_names.append(file_name)
+        return arr_file_names
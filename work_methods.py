@@ -1,48 +1,48 @@
 import numpy as np
+from typing import List, Union, TYPE_CHECKING
 import pandas as pd
-import hiplot as hip
-from evaluation import Experiment
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-def matrix_recover(all_data:pd.DataFrame, to_show:int, square_reference:int) -> list:
-    line_breaker = 0
-    matrix_row = 0
-    matrix = []
-    matrix.append([])
-
-    # pass through all_data
-    for index, row in all_data.iterrows():
-        
-        # the choosen one
-        if index == to_show:
-            
-            # recover itens
-            for item in row:
-                
-                # filter the y_class item
-                if matrix_row < square_reference:
-                    
-                    # build matrix
-                    matrix[matrix_row].append(item)
-                    line_breaker += 1
-                    
-                    # new line
-                    if (line_breaker%square_reference == 0):
-                        matrix_row += 1
-                        
-                        # append new line except for the last one
-                        if matrix_row < square_reference:
-                            matrix.append([])
-                            
-                        line_breaker = 0
-            
-            # No need to run iterrows until the end
-            break
-
-    return matrix
+from file_pipeline import run_pipeline, CropStage, BinarizeStage, DropMissingStage
+
+# plotting libraries, optuna and sklearn are imported only by the functions that use them,
+# so converting files does not load them
+if TYPE_CHECKING:
+    from evaluation import Experiment
+
+def _pixel_rows(all_data:Union[pd.DataFrame, np.ndarray], rows, square_reference:int) -> np.ndarray:
+    # first square_reference*square_reference columns (the pixels) of the given rows, by position
+    num_pixels = square_reference*square_reference
+    if isinstance(all_data, pd.DataFrame):
+        return all_data.iloc[rows, :num_pixels].to_numpy()
+    return np.asarray(all_data)[rows, :num_pixels]
+
+def matrix_recover(all_data:Union[pd.DataFrame, np.ndarray], to_show:int, square_reference:int) -> np.ndarray:
+    # the choosen one (row to_show), as a square_reference x square_reference matrix
+    return _pixel_rows(all_data, to_show, square_reference).reshape(square_reference, square_reference)
+
+def matrix_recover_batch(all_data:Union[pd.DataFrame, np.ndarray], square_reference:int, indices:List[int]=None,
+                        category=None, col_category:str='y_class', labels:np.ndarray=None) -> np.ndarray:
+    """
+    Recover many images at once as a (n, square_reference, square_reference) tensor.
+
+    all_data: DataFrame (or pixel matrix) with one image per row
+    indices: rows (by position) to recover, default all
+    category: when set, only rows of this category are recovered
+    col_category: category column of all_data (DataFrame)
+    labels: category of each row, when all_data is a pixel matrix
+    """
+    if indices is None:
+        indices = np.arange(len(all_data))
+    indices = np.asarray(indices)
+
+    if category is not None:
+        if labels is None:
+            labels = all_data[col_category].to_numpy()
+        indices = indices[np.asarray(labels)[indices] == category]
+
+    return _pixel_rows(all_data, indices, square_reference).reshape(-1, square_reference, square_reference)
 
 def plot_metric(metric_scores, metric_name, color):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 6))
     bars = plt.bar(metric_scores.keys(), metric_scores.values(), color=color)
     plt.xlabel('Categoria')
@@ -56,7 +56,9 @@ def plot_metric(metric_scores, metric_name, color):
     plt.xticks(list(metric_scores.keys()))  
     plt.show()
 
-def show_results(name:str, numbers:dict, exp:Experiment) -> None:
+def show_results(name:str, numbers:dict, exp:"Experiment") -> None:
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     print(name)
     categories = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
     for result in exp.results:
@@ -80,31 +82,25 @@ def show_results(name:str, numbers:dict, exp:Experiment) -> None:
     
 def parameters_graph(trials_fold) -> None:
     # build a graph for passed trials fold parameters swap
+    import hiplot as hip
     data = [{**trial.params, 'loss': trial.value} for trial in trials_fold]
     hip.Experiment.from_iterable(data).display(force_full_width=True)
 
-def info_gain_matrix_recover(info_gain_database:pd.DataFrame, square_reference:int) -> list:
-
-    # Start
-    info_gain_matrix_index = 0
-    info_gain_matrix = []
-    info_gain_matrix.append([])
-
-    # Pass through the DataFrame's rows and fill matrix with values calculated
-    line_breaker = 0
-    for index, row in info_gain_database.iterrows():
-        for item in row:
-            if not('pixel' in str(item)):
-                if info_gain_matrix_index < square_reference:
-                    info_gain_matrix[info_gain_matrix_index].append(item)
-                    line_breaker += 1
-                    if (line_breaker % square_reference == 0):
-                        info_gain_matrix_index += 1
-                        if info_gain_matrix_index < square_reference:
-                            info_gain_matrix.append([])
-                        line_breaker = 0
-    
-    return info_gain_matrix
+def info_gain_matrix_recover(info_gain_database:Union[pd.DataFrame, pd.Series], square_reference:int) -> np.ndarray:
+    """
+    Information gain of each pixel as a square_reference x square_reference matrix.
+
+    info_gain_database: Series returned by information_gain_matrix, or a DataFrame
+                        with the feature names ('pixel...') and their information gain
+    """
+    if isinstance(info_gain_database, pd.Series):
+        values = info_gain_database.to_numpy()
+    else:
+        # skip the feature names, keep the values in row order
+        values = info_gain_database.to_numpy().ravel()
+        values = values[np.char.find(values.astype(str), 'pixel') < 0]
+
+    return values[:square_reference*square_reference].astype(float).reshape(square_reference, square_reference)
 
 def create_filter_array(square_reference:int, start_row:int, start_column:int, last_row:int, last_column:int) -> list:
     filtr = np.zeros((28,28))
@@ -122,53 +118,10 @@ def create_filter_array(square_reference:int, start_row:int, start_column:int, l
     
     return filtr_array
 
-def create_selected_base(input_file_name:str, output_file_name:str, filtr_array:list) -> None:
-    #handling file and filter by info gain 
-    new_file = open(output_file_name, 'w')
-    with open(input_file_name, 'r') as file:
-        first_row = True
-        for line in file:
-            row_to_write = ''
-            items = line.split(',')
-            for i in range(len(items)):
-                if filtr_array[i] == 1:
-                    row_to_write += items[i]+','
-                elif filtr_array[i] == 2:
-                    row_to_write += items[i]
-            nan = False
-            if not first_row:
-                for item in row_to_write:
-                    if not item.isnumeric() and not item.isalpha() and item!=',' and item!='\n':
-                        nan = True
-            if row_to_write.count(',') == 400 and not nan:
-                new_file.write(row_to_write)
-            first_row = False
-
-    new_file.close()
-
-def create_binary_base(input_file_name:str, output_file_name:str) -> None:
-    #handling file and transform numbers to 0 or 1
-    new_file = open(output_file_name, 'w')
-    with open(input_file_name, 'r') as file:
-        first_row = True
-        for line in file:
-            row_to_write = ''
-            items = line.split(',')
-            for i in range(len(items)):
-                if first_row:
-                    if '\n' in items[i]:
-                        row_to_write += items[i]
-                    else:
-                        row_to_write += items[i]+','
-                else:
-                    if '\n' in items[i]:
-                        row_to_write += items[i]
-                    else:
-                        if float(items[i]) == 0.0:
-                            row_to_write += '0,'
-                        else:
-                            row_to_write += '1,'
-            new_file.write(row_to_write)
-            first_row = False
-
-    new_file.close()
\ No newline at end of file
+def create_selected_base(input_file_name:str, output_file_name:str, filtr_array:list, chunk_size:int=4096) -> None:
+    # keep the pixels selected by filtr_array and drop rows with NaN (or invalid) values
+    run_pipeline(input_file_name, output_file_name, [CropStage(filtr_array), DropMissingStage()], chunk_size)
+
+def create_binary_base(input_file_name:str, output_file_name:str, chunk_size:int=4096) -> None:
+    # transform pixels to 0 or 1
+    run_pipeline(input_file_name, output_file_name, [DropMissingStage(), BinarizeStage()], chunk_size)